@@ -3,8 +3,6 @@ import json
 
 sys.path.append(r"c:\cgteamwork\bin\base")
 sys.path.append('C:/cgteamwork/bin/cgtw')
-import cgtw2
-import ct
 
 
 class CGTCore:
@@ -62,6 +60,10 @@ class CGTCore:
         :return: the connection and database and any errors. If can't connect returns None for the connection and database
         """
         try:
+            # cgt's libraries are slow to import, so only import them once a connection is needed. This keeps
+            # argument parsing and --help fast in the bridge scripts
+            import cgtw2
+            import ct
             # If you are logged in to CGT, can do "cgtw2.tw()", otherwise need username and password
             if ip_addr is None and username is None and password is None:
                 connection = cgtw2.tw()
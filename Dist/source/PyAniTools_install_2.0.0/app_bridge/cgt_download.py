@@ -3,14 +3,17 @@ import os
 import json
 import re
 import argparse
+import time
+import threading
+import Queue
 
 sys.path.append('c:/cgteamwork/bin/base')
 sys.path.append('c:/cgteamwork/bin/cgtw/ct')
-import cgtw2
-from ct_http import ct_http
 
 import cgt_core
 import cgt_file_info
+import cgt_download_cache
+import cgt_download_queue
 
 
 class CGTDownload:
@@ -18,16 +21,34 @@ class CGTDownload:
     class object that provides support to download files from CGT
     """
 
-    def __init__(self, database=None, ip_addr=None, username=None, password=None):
+    # most files the folder walk can get ahead of the downloads, bounds memory when downloading large folders
+    max_queued_files = 500
+    # most files and bytes sent to cgt in one download call. Keeping batches small lets a critical file queued behind
+    # bulk files start soon and keeps bandwidth limit pauses short. The byte cap only counts files cgt gives a size for
+    max_batch_size = 50
+    max_batch_bytes = 50 * 1024 * 1024
+
+    def __init__(
+            self, database=None, ip_addr=None, username=None, password=None, cache_dir=None, bandwidth_schedule=""
+    ):
         """
         If no user name, password and ip provided, CGT must be open
         :param database: the CGT database to connect to
         :param ip_addr: optional ip address (no http://)
         :param username: optional username
         :param password:  optional password
+        :param cache_dir: optional folder for the local download cache, see cgt_download_cache. No caching if not given
+        :param bandwidth_schedule: optional download rate caps by time of day, see cgt_download_queue.BandwidthLimiter
         """
         self.cgt_core = cgt_core.CGTCore(database=database, ip_addr=ip_addr, username=username, password=password)
+        # the folder walk runs in its own thread with its own connection, keep the login to make it
+        self.login_info = {"database": database, "ip_addr": ip_addr, "username": username, "password": password}
         self.cgt_file_info_obj = cgt_file_info.CGTFileListing(connection=self.cgt_core)
+        if cache_dir:
+            self.cache = cgt_download_cache.CGTDownloadCache(cache_dir)
+        else:
+            self.cache = None
+        self.bandwidth_limiter = cgt_download_queue.BandwidthLimiter(bandwidth_schedule)
 
     @staticmethod
     def download_progress_callback(a, b, c):
@@ -57,86 +78,207 @@ class CGTDownload:
     ):
         """
         Access CGT and download a file, if no login info is given, then CG Teamworks app must be open and logged in,
-        otherwise give ip address and login info
+        otherwise give ip address and login info. Folders are walked in a separate thread that feeds a bounded queue,
+        so downloads start as soon as the first files are found and the file lists are never held in memory all at
+        once. Queued files download by priority class then in the order found, see cgt_download_queue.
         :param cgt_paths: a list of file paths on CGT to download
         :param download_paths: a list of corresponding file paths on the C or Z drive that specify where the downloaded
         files go
         :param use_callback: optional, callback function
-        :param show_file_info: optional, shows the files to be downloaded and number of files
+        :param show_file_info: deprecated, ignored
         :returns error if encountered, otherwise None.
         """
+        if self.bandwidth_limiter.schedule_error:
+            return self.bandwidth_limiter.schedule_error
+
         try:
-            # list of files on cgt to download
-            file_list_to_dl = []
-            # list of file paths on local machine corresponding to the file on cgt, where to put cgt file downloaded
-            download_loc_list = []
+            # check every path exists before downloading anything, one server call per path gets whether the path
+            # exists and whether its a file
+            path_infos = []
+            for cgt_path in cgt_paths:
+                file_info = self.cgt_file_info_obj.get_file_info(cgt_path)
+                if not file_info:
+                    return "Error downloading from CGT, the file path {0} doesn't exist".format(cgt_path)
+                path_infos.append(file_info)
+
+            file_queue = cgt_download_queue.CGTDownloadQueue(maxsize=self.max_queued_files)
+            stop_event = threading.Event()
+            walk_errors = []
+            walker = threading.Thread(
+                target=self._queue_files_to_download,
+                args=(cgt_paths, download_paths, path_infos, file_queue, stop_event, walk_errors)
+            )
+            walker.daemon = True
+            walker.start()
+
+            error = None
+            file_errors = []
+            try:
+                for batch in self._get_download_batches(file_queue):
+                    error = self._download_batch(batch, use_callback, file_errors)
+                    if error:
+                        break
+            finally:
+                # stop the walk if the downloads stopped early, it may be waiting on a full queue
+                stop_event.set()
+                walker.join()
+
+            if self.cache:
+                cache_error = self.cache.save()
+                if not error:
+                    error = cache_error
+
+            if error:
+                return error
+            if walk_errors:
+                return walk_errors[0]
+            if file_errors:
+                return "\n".join(file_errors)
+            return None
+
+        except Exception as e:
+            error = "Error downloading from CGT, error reported is {0}".format(e)
+            return error
 
-            # loop through the cgt paths provided and get the files to download
+    def _queue_files_to_download(self, cgt_paths, download_paths, path_infos, file_queue, stop_event, walk_errors):
+        """
+        Walks the cgt paths and puts each file to download on the queue as it is found, runs in its own thread with its
+        own cgt connection, the main thread's connection is busy downloading. Puts None on the queue when done
+        :param cgt_paths: a list of file paths on CGT to download
+        :param download_paths: a list of corresponding file paths on the local machine
+        :param path_infos: a list of the cgt file info dict for each cgt path
+        :param file_queue: the queue the files go in as (cgt file path, local file path, cgt file info) tuples
+        :param stop_event: set when the downloads stopped, the walk stops too
+        :param walk_errors: list that gets any walk error
+        """
+        try:
+            walk_file_info_obj = None
             for index in range(0, len(cgt_paths)):
-                # check if path exists, if not no need to proceed
-                if not self.cgt_file_info_obj.file_path_exists(cgt_paths[index]):
-                    return "Error downloading from CGT, the file path {0} doesn't exist".format(cgt_paths[index])
-
-                # if this is a directory, get file listing
-                if not self.cgt_file_info_obj.is_file(cgt_paths[index]):
-                    # get the list of files.
-                    file_list = self.cgt_file_info_obj.get_file_list(cgt_paths[index], files_only=True)
-                    # check if there are files, if not folder is empty so don't download anything
-                    if file_list:
-                        file_list_to_dl.extend(file_list)
-                        download_loc_list.extend(
-                            [file_path.replace(cgt_paths[index], download_paths[index]).replace("/", "\\") for file_path
-                             in
-                             file_list]
-                        )
                 # its a single file
-                else:
-                    # file to download
-                    file_list_to_dl.extend([cgt_paths[index]])
+                if path_infos[index]['is_file'].lower() == 'y':
                     # make the download path
                     path_parts = cgt_paths[index].split("/")
                     path_to_filename = '/'.join(path_parts[:-1])
-                    download_loc_list.extend(
-                        [os.path.normpath(cgt_paths[index].replace(path_to_filename, download_paths[index]))]
+                    download_location = os.path.normpath(
+                        cgt_paths[index].replace(path_to_filename, download_paths[index])
                     )
+                    item = (cgt_paths[index], download_location, path_infos[index])
+                    if not self._put_file(file_queue, stop_event, item):
+                        return
+                    continue
 
-            # todo: deprecate
-            show_file_info = False
-            if show_file_info:
-                # print the number of files to download
-                print "file_total:{0}".format(len(file_list_to_dl))
-                # print the files that will be downloaded so old files can be removed, use a '#' because a ":" will
-                # break parsing since these are files and they have C:\ in it. Also put files to download
-                # and files on cgt on same line otherwise can have issues where it doesn't process in order, ie.
-                # with separate print statements
-                print u"file_dirs_to_dl#{0}@file_names#{1}".format(
-                    ','.join(download_paths),  # lets us find the existing files
-                    ",".join(download_loc_list)  # lets us know what files are on CGT
-                )
-
-            # check if files to download
-            if file_list_to_dl:
-                # download the files from CGT
-                if use_callback:
-                    msg = self.cgt_core.connection.media_file.download_path(
-                        self.cgt_core.database, file_list_to_dl, download_loc_list, self.download_progress_callback
-                    )
-                else:
-                    msg = self.cgt_core.connection.media_file.download_path(
-                        self.cgt_core.database, file_list_to_dl, download_loc_list
-                    )
-                # set explicit == True because msg may be True, or have content. Just putting if msg, would return
-                # None when msg has content which is wrong
-                if msg == True:
-                    return None
-                else:
-                    return msg
-            else:
-                return None
+                if not walk_file_info_obj:
+                    walk_core = cgt_core.CGTCore(**self.login_info)
+                    if not walk_core.valid_connection():
+                        walk_errors.append(walk_core.connection_error_msg)
+                        return
+                    walk_file_info_obj = cgt_file_info.CGTFileListing(connection=walk_core)
 
+                # a directory, queue its files as the walk finds them. An empty folder downloads nothing
+                for file_path, file_info in walk_file_info_obj.iter_file_list(cgt_paths[index], files_only=True):
+                    download_location = file_path.replace(cgt_paths[index], download_paths[index]).replace("/", "\\")
+                    if not self._put_file(file_queue, stop_event, (file_path, download_location, file_info)):
+                        return
         except Exception as e:
-            error = "Error downloading from CGT, error reported is {0}".format(e)
-            return error
+            walk_errors.append("Error getting the files to download from CGT, error reported is {0}".format(e))
+        finally:
+            self._put_file(file_queue, stop_event, None)
+
+    @staticmethod
+    def _put_file(file_queue, stop_event, item):
+        """
+        Puts a file on the queue, waiting while the queue is full
+        :param file_queue: the queue
+        :param stop_event: set when the downloads stopped
+        :param item: the file to put on the queue
+        :return: True if queued, False if the downloads stopped
+        """
+        while not stop_event.is_set():
+            try:
+                file_queue.put(item, timeout=0.5)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def _get_download_batches(self, file_queue):
+        """
+        Takes the queued files in batches for cgt. Waits for the next file, then takes other queued files of the same
+        priority up to the batch limits, so a batch never waits on the walk
+        :param file_queue: the cgt_download_queue.CGTDownloadQueue the walk fills
+        :return: yields lists of (cgt file path, local file path, cgt file info) tuples
+        """
+        while True:
+            batch = file_queue.get_batch(self.max_batch_size, self.max_batch_bytes)
+            if not batch:
+                return
+            yield batch
+
+    def _download_batch(self, batch, use_callback, file_errors):
+        """
+        Downloads a batch of files from cgt
+        :param batch: list of (cgt file path, local file path, cgt file info) tuples
+        :param use_callback: whether to print download progress
+        :param file_errors: list that gets an error for each file that downloaded but couldn't be put in place, ex: open
+        in another program. These don't stop the other downloads
+        :return: error if encountered, otherwise None
+        """
+        # fill what we can from the local cache, only download the rest
+        if self.cache:
+            batch = [
+                (cgt_file_path, download_location, file_info) for cgt_file_path, download_location, file_info in batch
+                if not self.cache.fetch(cgt_file_path, file_info, download_location)
+            ]
+            if not batch:
+                return None
+
+        # an existing file of a hardlinked type may be linked to the cache's copy, download it to a temp name and swap
+        # it in after so the download never writes through the link into the cache
+        download_loc_list = []
+        for cgt_file_path, download_location, file_info in batch:
+            if self.cache and cgt_download_cache.is_hardlink_type(cgt_file_path) and os.path.exists(download_location):
+                download_loc_list.append(download_location + ".cgtdownload")
+            else:
+                download_loc_list.append(download_location)
+
+        start_time = time.time()
+        file_list_to_dl = [cgt_file_path for cgt_file_path, download_location, file_info in batch]
+        # download the files from CGT
+        if use_callback:
+            msg = self.cgt_core.connection.media_file.download_path(
+                self.cgt_core.database, file_list_to_dl, download_loc_list, self.download_progress_callback
+            )
+        else:
+            msg = self.cgt_core.connection.media_file.download_path(
+                self.cgt_core.database, file_list_to_dl, download_loc_list
+            )
+        # set explicit == True because msg may be True, or have content. Just putting if msg, would return
+        # None when msg has content which is wrong
+        if msg == True:
+            downloaded_bytes = sum([os.path.getsize(loc) for loc in download_loc_list if os.path.exists(loc)])
+            for (cgt_file_path, download_location, file_info), loc in zip(batch, download_loc_list):
+                if loc != download_location:
+                    try:
+                        cgt_download_cache.replace_file(loc, download_location)
+                    except (IOError, OSError) as e:
+                        file_errors.append(
+                            "Could not replace {0}, it may be open in another program. Error reported is {1}".format(
+                                download_location, e
+                            )
+                        )
+                        if os.path.exists(loc):
+                            os.remove(loc)
+                        continue
+                if self.cache:
+                    self.cache.add(cgt_file_path, file_info, download_location)
+            self.bandwidth_limiter.throttle(downloaded_bytes, time.time() - start_time)
+            return None
+        else:
+            # leave the existing files as they were
+            for (cgt_file_path, download_location, file_info), loc in zip(batch, download_loc_list):
+                if loc != download_location and os.path.exists(loc):
+                    os.remove(loc)
+            return msg
 
 
 def main():
@@ -171,18 +313,38 @@ def main():
         username = sys.argv[4]
         password = sys.argv[5]
 
+    # optional folder for the local download cache
+    if len(sys.argv) > 6:
+        cache_dir = sys.argv[6]
+    else:
+        cache_dir = None
+    # optional download rate caps by time of day, ex: "09:00-19:00=2000000"
+    if len(sys.argv) > 7:
+        bandwidth_schedule = sys.argv[7]
+    else:
+        bandwidth_schedule = ""
+
     # make a cgt object
-    cgt_dl = CGTDownload(ip_addr=ip_addr, username=username, password=password)
+    cgt_dl = CGTDownload(
+        ip_addr=ip_addr, username=username, password=password, cache_dir=cache_dir,
+        bandwidth_schedule=bandwidth_schedule
+    )
     # make sure we connected
     if not cgt_dl.cgt_core.valid_connection():
         print cgt_dl.cgt_core.connection_error_msg
         return
+    if cgt_dl.bandwidth_limiter.schedule_error:
+        print cgt_dl.bandwidth_limiter.schedule_error
+        return
 
     # prepare multiple paths into a list - python lists are passed as file1,file2,... since you can't pass
     # an actual list, i.e. [file1, file2]
     cgt_path = cgt_path.split(",")
     download_path = download_path.split(",")
     error = cgt_dl.download_cgt(cgt_path, download_path)
+    # stdout is read back as the error, so the cache counts go to stderr
+    if cgt_dl.cache:
+        sys.stderr.write(cgt_dl.cache.stats() + "\n")
     if error:
         print error
     else:
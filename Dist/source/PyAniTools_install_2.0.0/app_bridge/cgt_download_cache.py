@@ -0,0 +1,391 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import threading
+
+
+# large files nobody edits in place are hardlinked between the store and their download locations. Everything else,
+# like tool scripts an artist may edit and save, gets its own copy so an edit can't change the store or other copies
+hardlink_extensions = [".mov", ".mp4", ".exr", ".wav", ".mb", ".ma", ".abc"]
+# a lock file older than this is left from a crashed process and is taken over
+stale_lock_seconds = 60
+# objects missing from the index that are younger than this may belong to another process still downloading, they
+# count towards the size cap but aren't removed
+orphan_grace_seconds = 60 * 60
+
+
+class CGTDownloadCache:
+    """
+    class object that keeps a local content addressed store of files downloaded from CGT. The same server file often
+    goes to several places on the local machine, like tools under C:\\PyAniTools and Z:, or the same review movie into
+    several date folders. A file is keyed by its CGT path, modify time and size, so a second request for an unchanged
+    server file is filled from the store instead of another download. Large read only types are hardlinked, see
+    hardlink_extensions, other files are copied. The store also records each object's modified time, so a hardlinked
+    file that was written in place is caught and removed from the store instead of being reused.
+
+    Several downloads can share a store. Each saves its changes by merging them into the index on disk under a lock
+    file, so one download doesn't overwrite another's entries or counts.
+
+    The store holds files as <cache dir>/objects/<key[:2]>/<key> with an index json formatted as:
+        {
+            "files": {
+                "<key>": {
+                    "cgt_path": "/LongGong/tools/maya/scripts/lt_awesome.mel",
+                    "size": 1234,
+                    "mtime": 1579305600.0,
+                    "sha1": "..." (only when content hashing is on),
+                    "last_used": 1579305600.0
+                },
+                ...
+            },
+            "stats": {"hits": 0, "misses": 0, "bytes_saved": 0}
+        }
+    """
+
+    index_name = "cache_index.json"
+
+    def __init__(self, cache_dir, max_bytes=20 * 1024 ** 3, use_content_hash=False):
+        """
+        :param cache_dir: folder for the store, should be on the same drive as most downloads so hardlinks work
+        :param max_bytes: optional size cap, least recently used files are evicted past it. Defaults to 20 GB
+        :param use_content_hash: hash files when they're added and check the hash before reusing them, catches a
+        hardlinked file that was edited in place
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.use_content_hash = use_content_hash
+        self.index_path = os.path.join(cache_dir, self.index_name)
+        self.lock_path = self.index_path + ".lock"
+        self._lock = threading.Lock()
+        self.index = self._read_index()
+        # stats as last read from disk, what this download adds to them is merged in on save
+        self._saved_stats = dict(self.index["stats"])
+        # keys this download removed, not brought back from the index on disk on save
+        self._removed_keys = set()
+
+    def _read_index(self):
+        """
+        :return: the index on disk, or an empty index if there isn't one or it is damaged
+        """
+        index = {"files": {}, "stats": {"hits": 0, "misses": 0, "bytes_saved": 0}}
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, "r") as read_file:
+                    index.update(json.load(read_file))
+            except (IOError, OSError, ValueError):
+                # a damaged index only costs downloads, start a new one
+                pass
+        return index
+
+    @staticmethod
+    def make_key(cgt_path, file_info):
+        """
+        :param cgt_path: the file's path on cgt
+        :param file_info: the file's info dict from cgt
+        :return: the cache key, or None if cgt didn't give a modify time so the file can't be safely cached
+        """
+        modify_time = file_info.get('modify_time', '') if file_info else ''
+        if not modify_time:
+            return None
+        key_source = u"{0}|{1}|{2}".format(cgt_path, modify_time, file_info.get('size', ''))
+        return hashlib.sha1(key_source.encode('utf-8')).hexdigest()
+
+    def _object_path(self, key):
+        return os.path.join(self.cache_dir, "objects", key[:2], key)
+
+    def fetch(self, cgt_path, file_info, download_location):
+        """
+        Fills a download from the store if the server file is cached
+        :param cgt_path: the file's path on cgt
+        :param file_info: the file's info dict from cgt
+        :param download_location: where the file should go on the local machine
+        :return: True if the file was filled from the store, False if it needs downloading
+        """
+        key = self.make_key(cgt_path, file_info)
+        with self._lock:
+            entry = self.index["files"].get(key) if key else None
+            object_path = self._object_path(key) if key else None
+            if not entry or not self._is_unchanged(object_path, entry):
+                self.index["stats"]["misses"] += 1
+                if entry:
+                    self._remove(key)
+                return False
+
+        try:
+            place_file(object_path, download_location, allow_hardlink=is_hardlink_type(cgt_path))
+        except (IOError, OSError):
+            with self._lock:
+                self.index["stats"]["misses"] += 1
+            return False
+
+        with self._lock:
+            entry["last_used"] = time.time()
+            self.index["stats"]["hits"] += 1
+            self.index["stats"]["bytes_saved"] += entry["size"]
+        return True
+
+    def _is_unchanged(self, object_path, entry):
+        """
+        Checks a stored file is still what was downloaded, call with the lock held
+        :param object_path: the file in the store
+        :param entry: its index entry
+        :return: True if the file can be reused, False if it is missing or was changed
+        """
+        if not os.path.exists(object_path):
+            return False
+        object_stat = os.stat(object_path)
+        if object_stat.st_size != entry["size"]:
+            return False
+        # entries from before modified times were recorded are only trusted with content hashing on
+        if entry.get("mtime") != object_stat.st_mtime and not (self.use_content_hash and entry.get("sha1")):
+            return False
+        if self.use_content_hash and entry.get("sha1") and hash_file(object_path) != entry["sha1"]:
+            return False
+        return True
+
+    def add(self, cgt_path, file_info, local_path):
+        """
+        Adds a freshly downloaded file to the store
+        :param cgt_path: the file's path on cgt
+        :param file_info: the file's info dict from cgt
+        :param local_path: where the file was downloaded to
+        """
+        key = self.make_key(cgt_path, file_info)
+        if not key or not os.path.exists(local_path):
+            return
+        object_path = self._object_path(key)
+        try:
+            place_file(local_path, object_path, allow_hardlink=is_hardlink_type(cgt_path))
+            object_stat = os.stat(object_path)
+        except (IOError, OSError):
+            return
+        with self._lock:
+            self._removed_keys.discard(key)
+            self.index["files"][key] = {
+                "cgt_path": cgt_path,
+                "size": object_stat.st_size,
+                "mtime": object_stat.st_mtime,
+                "last_used": time.time()
+            }
+            if self.use_content_hash:
+                self.index["files"][key]["sha1"] = hash_file(object_path)
+            self._evict()
+
+    def _evict(self, orphan_bytes=0):
+        """
+        Removes least recently used files until the store is under its size cap, call with the lock held
+        :param orphan_bytes: optional size of the objects in the store that aren't in the index
+        """
+        if not self.max_bytes:
+            return
+        used = orphan_bytes + sum([entry["size"] for entry in self.index["files"].values()])
+        for key, entry in sorted(self.index["files"].items(), key=lambda item: item[1]["last_used"]):
+            if used <= self.max_bytes:
+                break
+            used -= entry["size"]
+            self._remove(key)
+
+    def _remove(self, key):
+        """
+        Removes a file from the store, call with the lock held. Hardlinked downloads keep their own link
+        """
+        object_path = self._object_path(key)
+        try:
+            if os.path.exists(object_path):
+                os.remove(object_path)
+        except (IOError, OSError):
+            pass
+        self.index["files"].pop(key, None)
+        self._removed_keys.add(key)
+
+    def _remove_orphans(self):
+        """
+        Removes objects that aren't in the index and are older than orphan_grace_seconds, left by a download that
+        crashed or whose index changes were lost. Call with the lock held
+        :return: the size of the orphans still in the store
+        """
+        orphan_bytes = 0
+        objects_dir = os.path.join(self.cache_dir, "objects")
+        for folder, _, file_names in os.walk(objects_dir):
+            for file_name in file_names:
+                if file_name in self.index["files"]:
+                    continue
+                object_path = os.path.join(folder, file_name)
+                try:
+                    object_stat = os.stat(object_path)
+                    if time.time() - object_stat.st_mtime < orphan_grace_seconds:
+                        orphan_bytes += object_stat.st_size
+                    else:
+                        os.remove(object_path)
+                except (IOError, OSError):
+                    pass
+        return orphan_bytes
+
+    def _merge_index(self, disk_index):
+        """
+        Merges this download's changes into the index read from disk, call with the lock held
+        :param disk_index: the index on disk
+        :return: the merged index
+        """
+        files = dict(disk_index["files"])
+        for key in self._removed_keys:
+            files.pop(key, None)
+        for key, entry in self.index["files"].items():
+            if key not in files or entry["last_used"] >= files[key]["last_used"]:
+                files[key] = entry
+        stats = dict(disk_index["stats"])
+        for name, value in self.index["stats"].items():
+            stats[name] = stats.get(name, 0) + value - self._saved_stats.get(name, 0)
+        return {"files": files, "stats": stats}
+
+    def _acquire_index_lock(self, timeout=30.0):
+        """
+        Makes the lock file that guards writing the index, waiting while another download holds it
+        :param timeout: most seconds to wait
+        :return: None if locked, error if couldn't lock
+        """
+        end_time = time.time() + timeout
+        while True:
+            try:
+                lock_file = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(lock_file, str(os.getpid()))
+                os.close(lock_file)
+                return None
+            except (IOError, OSError) as e:
+                if not os.path.exists(self.lock_path):
+                    return "Problem locking {0}. Error reported is {1}".format(self.index_path, e)
+            try:
+                if time.time() - os.path.getmtime(self.lock_path) > stale_lock_seconds:
+                    os.remove(self.lock_path)
+                    continue
+            except (IOError, OSError):
+                # released or taken over by another download in the meantime
+                continue
+            if time.time() > end_time:
+                return "Problem locking {0}, {1} is held by another download".format(self.index_path, self.lock_path)
+            time.sleep(0.1)
+
+    def save(self):
+        """
+        Merges this download's changes into the index on disk, removes files past the size cap, including objects
+        missing from the index, and writes the index to a temp file that replaces the old one
+        :return: None if wrote to disk, error if couldn't write
+        """
+        with self._lock:
+            try:
+                if not os.path.exists(self.cache_dir):
+                    os.makedirs(self.cache_dir)
+            except (IOError, OSError) as e:
+                return "Problem writing {0}. Error reported is {1}".format(self.index_path, e)
+            error = self._acquire_index_lock()
+            if error:
+                return error
+            temp_path = "{0}.{1}.tmp".format(self.index_path, os.getpid())
+            try:
+                self.index = self._merge_index(self._read_index())
+                self._evict(orphan_bytes=self._remove_orphans())
+                with open(temp_path, "w") as write_file:
+                    json.dump(self.index, write_file, indent=1)
+                replace_file(temp_path, self.index_path)
+                self._saved_stats = dict(self.index["stats"])
+                self._removed_keys = set()
+            except (IOError, OSError, EnvironmentError, ValueError) as e:
+                return "Problem writing {0}. Error reported is {1}".format(self.index_path, e)
+            finally:
+                for path in [temp_path, self.lock_path]:
+                    try:
+                        if os.path.exists(path):
+                            os.remove(path)
+                    except (IOError, OSError):
+                        pass
+        return None
+
+    def stats(self):
+        """
+        :return: a string with the hit and miss counts, hit rate and bytes saved
+        """
+        stats = self.index["stats"]
+        lookups = stats["hits"] + stats["misses"]
+        hit_rate = 100.0 * stats["hits"] / lookups if lookups else 0.0
+        return "cache hits:{0} misses:{1} hit rate:{2:.1f}% saved:{3:.1f} MB".format(
+            stats["hits"], stats["misses"], hit_rate, stats["bytes_saved"] / 1e6
+        )
+
+
+def hash_file(file_path, block_size=1024 * 1024):
+    """
+    :param file_path: the file to hash
+    :param block_size: how much to read at a time
+    :return: the sha1 hex digest of the file's contents
+    """
+    sha1 = hashlib.sha1()
+    with open(file_path, "rb") as read_file:
+        while True:
+            data = read_file.read(block_size)
+            if not data:
+                break
+            sha1.update(data)
+    return sha1.hexdigest()
+
+
+def make_hardlink(src_path, dst_path):
+    """
+    Hardlinks a file. Python 2 on windows has no os.link so fall back to the windows api
+    :param src_path: the existing file
+    :param dst_path: the link to make
+    :return: True if linked, False if the file system doesn't allow it, ex: different drives
+    """
+    try:
+        if hasattr(os, "link"):
+            os.link(src_path, dst_path)
+            return True
+        if sys.platform == "win32":
+            import ctypes
+            return bool(ctypes.windll.kernel32.CreateHardLinkW(unicode(dst_path), unicode(src_path), None))
+    except (OSError, AttributeError):
+        pass
+    return False
+
+
+def replace_file(src_path, dst_path):
+    """
+    Moves a file over another in one step, so readers see the old file or the new one, never a partial file. Python 2
+    on windows can't rename over an existing file so fall back to the windows api
+    :param src_path: the new file
+    :param dst_path: the file it replaces
+    """
+    if sys.platform == "win32":
+        import ctypes
+        # MOVEFILE_REPLACE_EXISTING | MOVEFILE_WRITE_THROUGH
+        if not ctypes.windll.kernel32.MoveFileExW(unicode(src_path), unicode(dst_path), 0x1 | 0x8):
+            raise ctypes.WinError()
+    else:
+        os.rename(src_path, dst_path)
+
+
+def is_hardlink_type(file_path):
+    """
+    :param file_path: a file path
+    :return: True if the file's type is safe to share between the store and downloads with a hardlink
+    """
+    return os.path.splitext(file_path)[1].lower() in hardlink_extensions
+
+
+def place_file(src_path, dst_path, allow_hardlink=False):
+    """
+    Puts a file at a path with a copy, or a hardlink when allowed and possible. Replaces any existing file, the
+    existing file is unlinked first so a file hardlinked to it is never written through
+    :param src_path: the existing file
+    :param dst_path: where it should go
+    :param allow_hardlink: link the file instead of copying it when the file system allows it
+    """
+    dst_dir = os.path.dirname(dst_path)
+    if dst_dir and not os.path.exists(dst_dir):
+        os.makedirs(dst_dir)
+    if os.path.exists(dst_path):
+        os.remove(dst_path)
+    if not allow_hardlink or not make_hardlink(src_path, dst_path):
+        shutil.copy2(src_path, dst_path)
@@ -0,0 +1,223 @@
+import os
+import time
+import datetime
+import threading
+import Queue
+
+
+# priority classes, lower downloads first. Small tool files artists wait on go before rigs and scenes, which go
+# before review movies and renders
+PRIORITY_CRITICAL = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2
+
+priority_by_extension = {
+    ".mel": PRIORITY_CRITICAL,
+    ".py": PRIORITY_CRITICAL,
+    ".json": PRIORITY_CRITICAL,
+    ".txt": PRIORITY_CRITICAL,
+    ".lt": PRIORITY_CRITICAL,
+    ".gizmo": PRIORITY_CRITICAL,
+    ".nk": PRIORITY_CRITICAL,
+    ".mb": PRIORITY_NORMAL,
+    ".ma": PRIORITY_NORMAL,
+    ".abc": PRIORITY_NORMAL,
+    ".mov": PRIORITY_BULK,
+    ".mp4": PRIORITY_BULK,
+    ".exr": PRIORITY_BULK,
+    ".wav": PRIORITY_BULK,
+    ".zip": PRIORITY_BULK
+}
+
+
+def get_priority(cgt_path):
+    """
+    :param cgt_path: the file's path on cgt
+    :return: the file's priority class from its extension, PRIORITY_NORMAL if the extension isn't known
+    """
+    return priority_by_extension.get(os.path.splitext(cgt_path)[1].lower(), PRIORITY_NORMAL)
+
+
+def get_size(file_info):
+    """
+    :param file_info: the file's info dict from cgt
+    :return: the file size in bytes, or None if cgt didn't give one
+    """
+    try:
+        return int(file_info.get('size'))
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+class CGTDownloadQueue:
+    """
+    class object that orders files waiting to download. Files come out by priority class, then in the order they were
+    found. CGT's listing doesn't give file sizes, so there's no smallest first within a class, the file type is the only
+    hint of size. A file's priority improves the longer it waits so bulk files in a busy queue still get their turn.
+    Has the same put/get behavior as Queue.Queue, putting None marks the end of the files.
+
+    Items are (cgt file path, local file path, cgt file info) tuples.
+    """
+
+    # seconds of waiting that moves a file up one priority class
+    aging_seconds = 120.0
+
+    def __init__(self, maxsize=500):
+        """
+        :param maxsize: most files held at once, put() waits when full
+        """
+        self.maxsize = maxsize
+        self._items = []
+        self._closed = False
+        self._condition = threading.Condition()
+        self._counter = 0
+
+    def put(self, item, timeout=None):
+        """
+        Adds a file, or None to mark the end of the files
+        :param item: a (cgt file path, local file path, cgt file info) tuple or None
+        :param timeout: optional seconds to wait while full, raises Queue.Full if still full
+        """
+        with self._condition:
+            if item is None:
+                self._closed = True
+                self._condition.notify_all()
+                return
+            end_time = time.time() + timeout if timeout is not None else None
+            while len(self._items) >= self.maxsize:
+                remaining = end_time - time.time() if end_time is not None else None
+                if remaining is not None and remaining <= 0:
+                    raise Queue.Full
+                self._condition.wait(remaining)
+            self._items.append(
+                {
+                    "item": item,
+                    "priority": get_priority(item[0]),
+                    # None when cgt doesn't give a size
+                    "size": get_size(item[2]),
+                    "queued": time.time(),
+                    # keeps the found order within a priority class
+                    "order": self._counter
+                }
+            )
+            self._counter += 1
+            self._condition.notify_all()
+
+    def _pop_next(self, max_priority=None):
+        """
+        Removes the file that should download next, call with the lock held. The queue is bounded so a scan is cheap
+        :param max_priority: optional, only take a file whose aged priority is at or better than this
+        :return: the queue entry or None if nothing qualifies
+        """
+        now = time.time()
+        best_index = None
+        best_key = None
+        for index, entry in enumerate(self._items):
+            # whole steps, so files queued a moment apart keep their found order
+            priority = entry["priority"] - int((now - entry["queued"]) / self.aging_seconds)
+            if max_priority is not None and priority > max_priority:
+                continue
+            key = (priority, entry["order"])
+            if best_key is None or key < best_key:
+                best_index, best_key = index, key
+        if best_index is None:
+            return None
+        self._condition.notify_all()
+        return self._items.pop(best_index)
+
+    def get_batch(self, max_files, max_bytes):
+        """
+        Waits for a file then returns it with other queued files of the same or better priority, up to the batch
+        limits
+        :param max_files: most files in a batch
+        :param max_bytes: most bytes in a batch, a single larger file is still returned on its own. Only files with a
+        size in their cgt info count toward it
+        :return: a list of (cgt file path, local file path, cgt file info) tuples, empty when there are no more files
+        """
+        with self._condition:
+            while not self._items and not self._closed:
+                self._condition.wait()
+            if not self._items:
+                return []
+            first = self._pop_next()
+            batch = [first["item"]]
+            batch_bytes = first["size"] or 0
+            while len(batch) < max_files and self._items:
+                entry = self._pop_next(max_priority=first["priority"])
+                if entry is None:
+                    break
+                if batch_bytes + (entry["size"] or 0) > max_bytes:
+                    # put it back, it goes in a later batch
+                    self._items.append(entry)
+                    break
+                batch.append(entry["item"])
+                batch_bytes += entry["size"] or 0
+            return batch
+
+
+class BandwidthLimiter:
+    """
+    class object that caps the average download rate by pausing between downloads. cgt does the transfer itself so
+    the rate can't be shaped inside a file, keeping batches small keeps the pauses short. The cap can change with the
+    time of day, for example only limit during work hours:
+        "09:00-19:00=2000000"
+    Several windows are separated with ";", rates are bytes per second. Outside every window there's no cap.
+    """
+
+    def __init__(self, schedule=""):
+        """
+        :param schedule: the schedule string, see class doc. Empty means no cap. A schedule that can't be read sets
+        schedule_error and caps nothing
+        """
+        # list of (start minute of day, end minute of day, bytes per second)
+        self.windows = []
+        self.schedule_error = ""
+        try:
+            for window in [part.strip() for part in schedule.split(";") if part.strip()]:
+                times, rate = window.split("=")
+                start, end = times.split("-")
+                rate = float(rate)
+                if rate <= 0:
+                    raise ValueError("rate must be more than 0")
+                self.windows.append((self._minute_of_day(start), self._minute_of_day(end), rate))
+        except ValueError as e:
+            self.windows = []
+            self.schedule_error = "Error reading the bandwidth schedule {0}, expected windows like " \
+                                  "09:00-19:00=2000000. Error reported is {1}".format(schedule, e)
+
+    @staticmethod
+    def _minute_of_day(time_str):
+        hours, minutes = time_str.strip().split(":")
+        hours, minutes = int(hours), int(minutes)
+        if not 0 <= hours <= 24 or not 0 <= minutes < 60:
+            raise ValueError("{0} isn't a time of day".format(time_str))
+        return hours * 60 + minutes
+
+    def current_limit(self, now=None):
+        """
+        :param now: optional datetime, defaults to now
+        :return: the cap in bytes per second, or None if there's no cap right now
+        """
+        if not now:
+            now = datetime.datetime.now()
+        minute = now.hour * 60 + now.minute
+        for start, end, rate in self.windows:
+            # a window can wrap past midnight, ex: 22:00-06:00
+            if start <= end and start <= minute < end:
+                return rate
+            if start > end and (minute >= start or minute < end):
+                return rate
+        return None
+
+    def throttle(self, bytes_transferred, seconds_taken):
+        """
+        Pauses so the transfer that just finished averages out to the current cap
+        :param bytes_transferred: bytes downloaded
+        :param seconds_taken: how long the download took
+        """
+        limit = self.current_limit()
+        if not limit:
+            return
+        pause = bytes_transferred / limit - seconds_taken
+        if pause > 0:
+            time.sleep(pause)
@@ -6,8 +6,6 @@ import argparse
 
 sys.path.append('c:/cgteamwork/bin/base')
 sys.path.append('c:/cgteamwork/bin/cgtw/ct')
-import cgtw2
-from ct_http import ct_http
 
 import cgt_core
 
@@ -94,36 +92,51 @@ class CGTFileListing:
         :param dirs_only: whether to only return directories
         :return: the file paths list, or string error message
         """
+        try:
+            return [
+                file_path for file_path, file_info in self.iter_file_list(
+                    dir_path, walk=walk, files_only=files_only, dirs_only=dirs_only
+                )
+            ]
+        except Exception, e:
+            print e.message
+
+    def iter_file_list(self, dir_path, walk=True, files_only=False, dirs_only=False):
+        """
+        Walks a directory path in CGT (online/cloud area) and yields files as each folder is listed, so callers can
+        start working on the first files before the walk finishes. Uses recursion
+        :param dir_path: the path as a string
+        :param walk: use recursion to follow sub folders
+        :param files_only: whether to only return files
+        :param dirs_only: whether to only return directories
+        :return: yields the file path and the file's info dict from cgt, which has keys like 'is_file' and
+        'modify_time'. Raises an exception if cgt can't be listed
+        """
         # add end slash
         if dir_path[-1] != '/':
             dir_path = dir_path + '/'
 
         dir_path = dir_path.encode('utf-8')
-        file_list = []
-        try:
-            # get file list from cgt as list of dicts
-            files_in_path = self._get_cgt_dir_listing(dir_path)
-            # remove blank files
-            files_in_path = [file_path for file_path in files_in_path if file_path['name'].strip() != ""]
-            for file_path in files_in_path:
-                if dirs_only:
-                    if file_path['is_file'].lower() == 'n':
-                        file_list.append(dir_path + file_path['name'].encode('utf-8'))
-                elif files_only:
-                    if file_path['is_file'].lower() == 'y':
-                        file_list.append(dir_path + file_path['name'].encode('utf-8'))
-                else:
-                    file_list.append(dir_path + file_path['name'].encode('utf-8'))
-                # get file list in sub folder
-                if walk:
-                    if file_path['is_file'].lower() == 'n':
-                        file_list += self.get_file_list(
+        # get file list from cgt as list of dicts
+        files_in_path = self._get_cgt_dir_listing(dir_path)
+        # remove blank files
+        files_in_path = [file_path for file_path in files_in_path if file_path['name'].strip() != ""]
+        for file_path in files_in_path:
+            if dirs_only:
+                if file_path['is_file'].lower() == 'n':
+                    yield dir_path + file_path['name'].encode('utf-8'), file_path
+            elif files_only:
+                if file_path['is_file'].lower() == 'y':
+                    yield dir_path + file_path['name'].encode('utf-8'), file_path
+            else:
+                yield dir_path + file_path['name'].encode('utf-8'), file_path
+            # get file list in sub folder
+            if walk:
+                if file_path['is_file'].lower() == 'n':
+                    for sub_file_path, sub_file_info in self.iter_file_list(
                             (dir_path + file_path['name']), walk=walk, files_only=files_only, dirs_only=dirs_only
-                        )
-            return file_list
-
-        except Exception, e:
-            print e.message
+                    ):
+                        yield sub_file_path, sub_file_info
 
     def get_modified_date(self, cgt_path):
         """
@@ -169,6 +182,15 @@ class CGTFileListing:
         else:
             return True
 
+    def get_file_info(self, cgt_path):
+        """
+        Gets a file or folder's information in one server call, use instead of calling file_path_exists and is_file
+        :param cgt_path: a cgt server path
+        :return a dict containing the files info, keys include 'name', 'is_file' and 'modify_time', or None if the path
+        doesn't exist
+        """
+        return self._get_file_info_for_file(cgt_path)
+
     def _get_file_info_for_file(self, cgt_path):
         """
         Gets the file dictionary from cgt containing information about the file
@@ -3,8 +3,6 @@ import ast
 
 sys.path.append(r"c:\cgteamwork\bin\base")
 sys.path.append('C:/cgteamwork/bin/cgtw')
-import cgtw2
-import ct
 
 import cgt_core
 
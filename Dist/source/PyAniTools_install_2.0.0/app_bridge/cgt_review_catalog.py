@@ -0,0 +1,309 @@
+import os
+import sys
+import re
+import json
+
+sys.path.append('c:/cgteamwork/bin/base')
+sys.path.append('c:/cgteamwork/bin/cgtw/ct')
+
+import cgt_core
+import cgt_file_info
+
+
+class CGTReviewCatalog:
+    """
+    class object that keeps a persisted catalog of the review movies on CGT. The review area is organized as
+    /LongGong/LA_review/<date>/<department>/<movie>, for example:
+        /LongGong/LA_review/20200117/animation/Seq140_Shot030_Ani_POL_v043.mov
+
+    The catalog is indexed by date, department, sequence/shot and version. Only date folders that are newer than the
+    last refresh get listed on CGT, everything else is answered from the local index, so finding the latest review
+    assets doesn't depend on how many review days exist on the server.
+
+    The catalog json is formatted as:
+        {
+            "last_refresh_date": "20200117",
+            "dates": {
+                "20200117": {
+                    "animation": [ "Seq140_Shot030_Ani_POL_v043.mov", ... ],
+                    ...
+                },
+                ...
+            },
+            "latest": {
+                "Seq140_Shot030": {
+                    "animation": {
+                        "version": 43,
+                        "date": "20200117",
+                        "file_name": "Seq140_Shot030_Ani_POL_v043.mov",
+                        "cgt_path": "/LongGong/LA_review/20200117/animation/Seq140_Shot030_Ani_POL_v043.mov"
+                    },
+                    ...
+                },
+                ...
+            }
+        }
+    """
+
+    # the root of the review area on CGT
+    review_root = "/LongGong/LA_review"
+    # matches the sequence and optional shot at the start of a review movie name
+    movie_pattern = re.compile(r"^(?P<seq>seq\d+)(?:_(?P<shot>shot\d+))?(?:_.*)?\.\w+$", re.IGNORECASE)
+    # part and version are searched for on their own since they can be anywhere after the shot, ex:
+    # Seq310_editorial_part1_v001.mov, Seq310_Ani_v002_part2.mov, Seq140_Shot030_v2.mov or
+    # Seq140_Shot030_Ani_v043_notes.mov. Movies without a version, ex: Seq310_layout.mov, are treated as version 0
+    part_pattern = re.compile(r"_part(\d+)", re.IGNORECASE)
+    version_pattern = re.compile(r"_v(\d+)(?=[_.])", re.IGNORECASE)
+    # date folders are named YYYYMMDD
+    date_pattern = re.compile(r"^\d{8}$")
+
+    def __init__(self, catalog_path, file_listing=None):
+        """
+        :param catalog_path: the path including file name for the json file holding the catalog
+        :param file_listing: optional cgt_file_info.CGTFileListing object used to list the review area on CGT, only
+        needed to refresh the catalog
+        """
+        self.catalog_path = catalog_path
+        self.file_listing = file_listing
+        self.catalog = {
+            "last_refresh_date": "",
+            "dates": {},
+            "latest": {}
+        }
+        self.load_error = self.load()
+
+    def load(self):
+        """
+        Loads the catalog from disk. A missing catalog is not an error, the catalog is built on the next refresh
+        :return: None if loaded or no catalog exists yet, otherwise error
+        """
+        if not os.path.exists(self.catalog_path):
+            return None
+        try:
+            with open(self.catalog_path, "r") as read_file:
+                catalog = json.load(read_file)
+        except (IOError, OSError, EnvironmentError, ValueError) as e:
+            error_msg = "Problem loading {0}. Error reported is {1}".format(self.catalog_path, e)
+            return error_msg
+
+        for key in self.catalog:
+            if key in catalog:
+                self.catalog[key] = catalog[key]
+        return None
+
+    def save(self):
+        """
+        Saves the catalog to disk, creates the directory holding the catalog if it doesn't exist
+        :return: None if saved, otherwise error
+        """
+        catalog_dir = os.path.dirname(self.catalog_path)
+        if catalog_dir and not os.path.exists(catalog_dir):
+            try:
+                os.makedirs(catalog_dir)
+            except (IOError, OSError) as e:
+                return "Could not create {0}. Error reported is {1}".format(catalog_dir, e)
+        return cgt_core.write_json(self.catalog_path, self.catalog, indent=1)
+
+    def refresh(self):
+        """
+        Lists the date folders on CGT and rebuilds the movies of any date folder that is the same or newer than the last
+        refresh. The last refreshed date is listed again because reviews can still be uploaded or removed the same day.
+        The catalog is saved after each date, so dates already refreshed are kept if a later listing fails.
+        :return: a list of the dates that were refreshed and any error, errors are None if no error occurred
+        """
+        if not self.file_listing:
+            return [], "No CGT connection available to refresh the review catalog."
+
+        date_folders = self.file_listing.get_file_list(self.review_root, dirs_only=True, walk=False)
+        if not isinstance(date_folders, list):
+            return [], "Error listing review dates on CGT under {0}".format(self.review_root)
+
+        last_refresh_date = self.catalog["last_refresh_date"]
+        dates_to_refresh = sorted(
+            [
+                date for date in [folder.rstrip("/").split("/")[-1] for folder in date_folders]
+                if self.date_pattern.match(date) and date >= last_refresh_date
+            ]
+        )
+
+        refreshed = []
+        for date in dates_to_refresh:
+            date_path = "{0}/{1}".format(self.review_root, date)
+            movie_paths = self.file_listing.get_file_list(date_path, files_only=True, walk=True)
+            if not isinstance(movie_paths, list):
+                return refreshed, "Error listing review movies on CGT under {0}".format(date_path)
+            self.rebuild_date(date, movie_paths)
+            self.catalog["last_refresh_date"] = date
+            error = self.save()
+            if error:
+                return refreshed, error
+            refreshed.append(date)
+
+        return refreshed, None
+
+    def rebuild_date(self, date, movie_paths):
+        """
+        Replaces a date's movies with a new listing. Latest entries that pointed at a movie no longer on CGT fall back
+        to the newest remaining version from any date
+        :param date: the date as YYYYMMDD
+        :param movie_paths: the cgt paths of every movie under the date folder
+        """
+        self.catalog["dates"][date] = {}
+        for movie_path in movie_paths:
+            self.add_movie(movie_path)
+        date_movies = self.catalog["dates"][date]
+
+        for movie_key, depts in self.catalog["latest"].items():
+            for dept, entry in depts.items():
+                if entry["date"] == date and entry["file_name"] not in date_movies.get(dept, []):
+                    del depts[dept]
+                    self._find_latest(movie_key, dept)
+            if not depts:
+                del self.catalog["latest"][movie_key]
+        if not date_movies:
+            del self.catalog["dates"][date]
+
+    def _find_latest(self, movie_key, dept):
+        """
+        Sets the latest entry for a sequence/shot and department from the date index
+        :param movie_key: the sequence/shot key, ex: Seq140_Shot030
+        :param dept: the department, ex: animation
+        """
+        for date, date_depts in self.catalog["dates"].items():
+            for file_name in date_depts.get(dept, []):
+                if self.parse_movie_name(file_name)[0] == movie_key:
+                    self.add_movie("{0}/{1}/{2}/{3}".format(self.review_root, date, dept, file_name))
+
+    def add_movie(self, cgt_path):
+        """
+        Adds a review movie to the date index and updates the latest version for its sequence/shot and department
+        :param cgt_path: the path to the movie on cgt, /LongGong/LA_review/<date>/<department>/<movie>
+        :return: True if the movie was added, False if the path isn't a review movie
+        """
+        path_parts = cgt_path.replace(self.review_root, "").strip("/").split("/")
+        # need at least date/department/movie
+        if len(path_parts) < 3:
+            return False
+        date = path_parts[0]
+        dept = path_parts[1]
+        file_name = path_parts[-1]
+
+        movie_key, version = self.parse_movie_name(file_name)
+        if not movie_key:
+            return False
+
+        dept_movies = self.catalog["dates"].setdefault(date, {}).setdefault(dept, [])
+        if file_name not in dept_movies:
+            dept_movies.append(file_name)
+
+        current = self.catalog["latest"].get(movie_key, {}).get(dept)
+        # newer version, or same version uploaded on a later day replaces what we have
+        if not current or (version, date) >= (current["version"], current["date"]):
+            self.catalog["latest"].setdefault(movie_key, {})[dept] = {
+                "version": version,
+                "date": date,
+                "file_name": file_name,
+                "cgt_path": cgt_path
+            }
+        return True
+
+    def parse_movie_name(self, file_name):
+        """
+        Gets the sequence/shot key and version from a review movie name
+        :param file_name: the movie name, ex: Seq140_Shot030_Ani_POL_v043.mov
+        :return: the key, ex: Seq140_Shot030, Seq310_part2 and the version as an int. Returns None, None if the name
+        isn't a review movie
+        """
+        match = self.movie_pattern.match(file_name)
+        if not match:
+            return None, None
+
+        key_parts = [match.group("seq").capitalize()]
+        if match.group("shot"):
+            key_parts.append(match.group("shot").capitalize())
+        part = self.part_pattern.search(file_name)
+        if part:
+            key_parts.append("part{0}".format(int(part.group(1))))
+
+        # the last version tag wins, ex: Seq140_Shot030_v1_redo_v2.mov is version 2
+        versions = self.version_pattern.findall(file_name)
+        version = int(versions[-1]) if versions else 0
+        return "_".join(key_parts), version
+
+    def latest_date(self):
+        """
+        :return: the most recent review date in the catalog or an empty string if the catalog is empty
+        """
+        if not self.catalog["dates"]:
+            return ""
+        return max(self.catalog["dates"])
+
+    def get_review(self, date=None):
+        """
+        Gets the review movies for a date
+        :param date: optional date as YYYYMMDD, defaults to the most recent review
+        :return: a dict of department: list of movie names
+        """
+        if not date:
+            date = self.latest_date()
+        return self.catalog["dates"].get(date, {})
+
+    def get_latest(self, movie_key, dept):
+        """
+        Gets the latest version of a sequence/shot's movie for a department
+        :param movie_key: the sequence/shot key, ex: Seq140_Shot030
+        :param dept: the department, ex: animation
+        :return: the movie's catalog entry, see class doc, or None if the department has no movie for the shot
+        """
+        return self.catalog["latest"].get(movie_key, {}).get(dept)
+
+    def get_latest_with_precedence(self, movie_key, precedence):
+        """
+        Resolves the one movie per shot option. The first department in the precedence list that has a movie for the
+        shot wins.
+        :param movie_key: the sequence/shot key, ex: Seq140_Shot030
+        :param precedence: a list of departments in order of precedence, ex: ["animation", "layout", "previs"]
+        :return: the department and its movie's catalog entry, or None, None if no department in the list has a movie
+        """
+        dept_movies = self.catalog["latest"].get(movie_key, {})
+        for dept in precedence:
+            if dept in dept_movies:
+                return dept, dept_movies[dept]
+        return None, None
+
+
+def main():
+    debug = False
+
+    if debug:
+        catalog_path = "C:\\Users\\Patrick\\Downloads\\review_catalog.json"
+        ip_addr = "172.18.100.246"
+        username = "publish"
+        password = "publish"
+    else:
+        catalog_path = sys.argv[1]
+        ip_addr = sys.argv[2]
+        username = sys.argv[3]
+        password = sys.argv[4]
+
+    # make a cgt object
+    cgt_file_listing = cgt_file_info.CGTFileListing(ip_addr=ip_addr, username=username, password=password)
+    # make sure we connected
+    if not cgt_file_listing.cgt_core.valid_connection():
+        print cgt_file_listing.cgt_core.connection_error_msg
+        return
+
+    review_catalog = CGTReviewCatalog(catalog_path, file_listing=cgt_file_listing)
+    if review_catalog.load_error:
+        print review_catalog.load_error
+        return
+
+    dates_refreshed, error = review_catalog.refresh()
+    if error:
+        print error
+    else:
+        print ""
+
+
+if __name__ == '__main__':
+    main()
@@ -5,8 +5,6 @@ sys.path.append('C:\\PyAniTools\\lib')
 
 sys.path.append(r"c:\cgteamwork\bin\base")
 sys.path.append('C:/cgteamwork/bin/cgtw')
-import cgtw2
-import ct
 
 import cgt_core
 
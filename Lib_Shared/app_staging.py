@@ -0,0 +1,297 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+
+import file_utils
+
+
+# files the os keeps locked while an app runs. These always get a real copy, a hardlink would share the lock with the
+# installed file and stop the updater replacing it
+locked_extensions = [".exe", ".dll", ".pyd"]
+# number of launch timings kept in the timing log
+max_launch_timings = 200
+
+
+def is_file_in_use(file_path):
+    """
+    Checks if a file is locked, on windows a running exe can't be opened for writing
+    :param file_path: the file to check
+    :return: True if the file is in use, False if not
+    """
+    if not os.path.exists(file_path):
+        return False
+    try:
+        with open(file_path, "r+b"):
+            return False
+    except (IOError, OSError):
+        return True
+
+
+def get_process_tree(pid):
+    """
+    Finds a process and all the processes it started, windows only
+    :param pid: the process id
+    :return: a list of process ids, the given process first
+    """
+    import ctypes
+    from ctypes import wintypes
+
+    class ProcessEntry32(ctypes.Structure):
+        _fields_ = [
+            ("dwSize", wintypes.DWORD),
+            ("cntUsage", wintypes.DWORD),
+            ("th32ProcessID", wintypes.DWORD),
+            ("th32DefaultHeapID", ctypes.c_void_p),
+            ("th32ModuleID", wintypes.DWORD),
+            ("cntThreads", wintypes.DWORD),
+            ("th32ParentProcessID", wintypes.DWORD),
+            ("pcPriClassBase", ctypes.c_long),
+            ("dwFlags", wintypes.DWORD),
+            ("szExeFile", ctypes.c_char * 260)
+        ]
+
+    kernel32 = ctypes.windll.kernel32
+    kernel32.CreateToolhelp32Snapshot.restype = wintypes.HANDLE
+    # TH32CS_SNAPPROCESS
+    snapshot = kernel32.CreateToolhelp32Snapshot(0x2, 0)
+    parents = {}
+    try:
+        entry = ProcessEntry32()
+        entry.dwSize = ctypes.sizeof(ProcessEntry32)
+        found = kernel32.Process32First(snapshot, ctypes.byref(entry))
+        while found:
+            parents[entry.th32ProcessID] = entry.th32ParentProcessID
+            found = kernel32.Process32Next(snapshot, ctypes.byref(entry))
+    finally:
+        kernel32.CloseHandle(snapshot)
+
+    tree = [pid]
+    for process_id in tree:
+        tree.extend([child for child, parent in parents.items() if parent == process_id and child not in tree])
+    return tree
+
+
+def has_visible_window(pids):
+    """
+    Checks if any of the processes shows a window, console windows don't count. Windows only
+    :param pids: list of process ids
+    :return: True if one of the processes has a visible top level window
+    """
+    import ctypes
+    from ctypes import wintypes
+
+    user32 = ctypes.windll.user32
+    found = []
+    class_name = ctypes.create_unicode_buffer(256)
+
+    def check_window(hwnd, _):
+        if not user32.IsWindowVisible(hwnd):
+            return True
+        pid = wintypes.DWORD()
+        user32.GetWindowThreadProcessId(hwnd, ctypes.byref(pid))
+        if pid.value not in pids:
+            return True
+        user32.GetClassNameW(hwnd, class_name, 256)
+        if class_name.value == "ConsoleWindowClass":
+            return True
+        found.append(hwnd)
+        return False
+
+    enum_windows_proc = ctypes.WINFUNCTYPE(wintypes.BOOL, wintypes.HWND, wintypes.LPARAM)
+    user32.EnumWindows(enum_windows_proc(check_window), 0)
+    return bool(found)
+
+
+class AniAppStaging:
+    """
+    Keeps a staged copy of an app so it can run from outside its install folder, which lets the updater replace the
+    installed app while it is open. The staged copy is reused across launches, only files that changed since the last
+    launch are copied. Files that aren't locked while the app runs are hardlinked when the file system allows it.
+
+    Staged copies live in <staging root>/<app name>/<generation> with a manifest of the size and modified time of each
+    installed file at the time it was staged. A new generation is only made when the current one is in use by a
+    running copy of the app, older generations are removed once nothing is running from them.
+    """
+
+    manifest_name = "staging_manifest.json"
+    timing_log_name = "launch_timing.json"
+
+    def __init__(self, app_path, app_name, staging_root=None):
+        """
+        :param app_path: path to the directory holding the installed app
+        :param app_name: name of the app, the exe is <app name>.exe
+        :param staging_root: optional folder holding the staged copies, defaults to the temp dir
+        """
+        self.app_path = app_path
+        self.app_name = app_name
+        if not staging_root:
+            staging_root = os.path.join(tempfile.gettempdir(), "pyanitools", "staging")
+        self.app_staging_root = os.path.join(staging_root, app_name)
+        self.staging_dir = None
+
+    def _generations(self):
+        """
+        :return: the existing generation folders, oldest first
+        """
+        if not os.path.exists(self.app_staging_root):
+            return []
+        return sorted(
+            [
+                name for name in os.listdir(self.app_staging_root)
+                if name.isdigit() and os.path.isdir(os.path.join(self.app_staging_root, name))
+            ],
+            key=int
+        )
+
+    def _exe_path(self, staging_dir):
+        return os.path.join(staging_dir, "{0}.exe".format(self.app_name))
+
+    def installed_manifest(self):
+        """
+        :return: dict of forward slash relative path: [size, modified time] for every installed file
+        """
+        manifest = {}
+        for dir_path, dir_names, file_names in os.walk(self.app_path):
+            for file_name in file_names:
+                file_path = os.path.join(dir_path, file_name)
+                file_stat = os.stat(file_path)
+                rel_path = os.path.relpath(file_path, self.app_path).replace("\\", "/")
+                manifest[rel_path] = [file_stat.st_size, int(file_stat.st_mtime)]
+        return manifest
+
+    def stage(self):
+        """
+        Brings the staged copy up to date with the installed app
+        :return: the number of files copied or linked and any error, error is None if staged
+        """
+        generations = self._generations()
+        # reuse the newest generation unless a running copy of the app has it locked
+        if generations and not is_file_in_use(self._exe_path(os.path.join(self.app_staging_root, generations[-1]))):
+            generation = generations[-1]
+        else:
+            generation = str(int(generations[-1]) + 1) if generations else "1"
+        self.staging_dir = os.path.join(self.app_staging_root, generation)
+
+        staged_manifest, error = file_utils.load_json(
+            os.path.join(self.staging_dir, self.manifest_name), default={}
+        )
+        if error:
+            staged_manifest = {}
+
+        try:
+            installed_manifest = self.installed_manifest()
+            files_staged = 0
+            for rel_path, file_info in installed_manifest.items():
+                dst_path = os.path.join(self.staging_dir, *rel_path.split("/"))
+                if staged_manifest.get(rel_path) == file_info and os.path.exists(dst_path):
+                    continue
+                src_path = os.path.join(self.app_path, *rel_path.split("/"))
+                dst_dir = os.path.dirname(dst_path)
+                if not os.path.exists(dst_dir):
+                    os.makedirs(dst_dir)
+                if os.path.exists(dst_path):
+                    os.remove(dst_path)
+                if (
+                    os.path.splitext(rel_path)[1].lower() in locked_extensions or
+                    not file_utils.make_hardlink(src_path, dst_path)
+                ):
+                    shutil.copy2(src_path, dst_path)
+                files_staged += 1
+
+            # remove files that are no longer part of the app
+            for rel_path in staged_manifest:
+                if rel_path not in installed_manifest:
+                    file_path = os.path.join(self.staging_dir, *rel_path.split("/"))
+                    if os.path.exists(file_path):
+                        os.remove(file_path)
+        except (IOError, OSError) as e:
+            return 0, "Could not stage {0} from {1}. Error reported is {2}".format(self.app_name, self.app_path, e)
+
+        error = file_utils.write_json(os.path.join(self.staging_dir, self.manifest_name), installed_manifest)
+        if error:
+            return files_staged, error
+
+        self.cleanup()
+        return files_staged, None
+
+    def cleanup(self):
+        """
+        Removes generations older than the current one that no running app is using
+        """
+        for generation in self._generations():
+            staging_dir = os.path.join(self.app_staging_root, generation)
+            if staging_dir == self.staging_dir:
+                continue
+            if not is_file_in_use(self._exe_path(staging_dir)):
+                shutil.rmtree(staging_dir, ignore_errors=True)
+
+    def launch(self, args=None, window_timeout=60):
+        """
+        Stages the app, starts it from the staged copy and records how long it took for the app's window to be ready
+        :param args: optional list of arguments to pass to the app
+        :param window_timeout: seconds to wait for the app's window before giving up on timing it
+        :return: the process and None, or None and an error
+        """
+        launch_start = time.time()
+        files_staged, error = self.stage()
+        if error:
+            return None, error
+        staged_time = time.time()
+
+        command = [self._exe_path(self.staging_dir)]
+        if args:
+            command.extend(args)
+        try:
+            process = subprocess.Popen(command, cwd=self.staging_dir)
+        except (IOError, OSError) as e:
+            return None, "Could not launch {0}. Error reported is {1}".format(command[0], e)
+
+        window_ready = self._wait_for_window(process, window_timeout)
+        window_time = time.time()
+        self.record_launch_timing(
+            {
+                "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "files_staged": files_staged,
+                "staging_seconds": round(staged_time - launch_start, 3),
+                "launch_to_window_seconds": round(window_time - launch_start, 3) if window_ready else None
+            }
+        )
+        return process, None
+
+    @staticmethod
+    def _wait_for_window(process, timeout, poll_seconds=0.05):
+        """
+        Waits until the app shows a window. Apps are built with pyinstaller --onefile, the process started is the
+        bootloader and the app runs in a child process, so this looks for a visible window owned by the process or any
+        of its children, ignoring the bootloader's console window. Only supported on windows
+        :param process: the app's process
+        :param timeout: seconds to wait
+        :param poll_seconds: seconds between checks
+        :return: True if the window is up, False if timed out, the app exited or not supported
+        """
+        if sys.platform != "win32":
+            return False
+        end_time = time.time() + timeout
+        while time.time() < end_time:
+            if has_visible_window(get_process_tree(process.pid)):
+                return True
+            if process.poll() is not None and not get_process_tree(process.pid)[1:]:
+                return False
+            time.sleep(poll_seconds)
+        return False
+
+    def record_launch_timing(self, timing):
+        """
+        Adds a launch timing to the app's timing log, keeps the last max_launch_timings entries
+        :param timing: dict of timing information
+        :return: None if recorded, otherwise error
+        """
+        timing_log_path = os.path.join(self.app_staging_root, self.timing_log_name)
+        timings, error = file_utils.load_json(timing_log_path, default=[])
+        if error:
+            timings = []
+        timings.append(timing)
+        return file_utils.write_json(timing_log_path, timings[-max_launch_timings:])
@@ -0,0 +1,394 @@
+'''
+Non blocking logging for the apps
+
+    pyani.core.error_logging.ErrorLogging sets up the root logger with the app's log file and format. Installing the
+    async handler after it moves the file writes to a background thread, keeping that file and format:
+
+        error_logging = pyani.core.error_logging.ErrorLogging(app_name, error_level)
+        error_logging.setup_logging()
+        async_logging.install()
+
+    Per call logging latency of a sync loop, the current synchronous file handler against the async handler, also with
+    a log file that fsyncs every flush:
+        python async_logging.py benchmark
+'''
+
+import os
+import time
+import Queue
+import atexit
+import logging
+import argparse
+import tempfile
+import timeit
+import threading
+
+
+# records per second a single logging call site can log at each level, the rest are counted and summarized. Keeps a
+# debug message inside a download or sync loop from flooding the log and the queue
+default_rate_limits = {logging.DEBUG: 20, logging.INFO: 50}
+# message arguments of these types can't change before the writer formats them, so the formatting is left to the writer
+immutable_types = (str, unicode, int, long, float, bool, type(None))
+
+
+class AniAsyncLogHandler(logging.Handler):
+    """
+    Puts records on a queue and returns, a background thread writes them to the handlers the app set up. Records are
+    written in batches with one flush per batch. The gui thread never waits on the disk, unless the queue is full of
+    unwritten records, then debug and info records are dropped and warnings and errors wait so they aren't lost.
+    Warnings and errors are written right away instead of waiting for the next batch, so they're on disk if the app
+    crashes.
+
+    Log files from logging.FileHandler targets rotate by size and optionally age. The current file keeps its name, older
+    ones are renamed <log file>.1, <log file>.2, ...
+    """
+
+    # seconds to wait before trying a rotation again after one failed, ex: another process has the log open
+    rotate_retry_seconds = 60.0
+
+    def __init__(
+            self, target_handlers, queue_size=10000, batch_size=500, flush_interval=0.5, max_bytes=10 * 1024 * 1024,
+            backup_count=5, rotate_seconds=None, rate_limits=None
+    ):
+        """
+        :param target_handlers: the handlers that write the records, usually the root logger's handlers
+        :param queue_size: most records waiting to be written
+        :param batch_size: most records written per flush
+        :param flush_interval: seconds the writer waits for more records before flushing what it has
+        :param max_bytes: rotate a log file at this size, None to not rotate by size
+        :param backup_count: number of rotated log files kept
+        :param rotate_seconds: optional, rotate a log file once it has been open this long
+        :param rate_limits: optional dict of level: records per second per logging call site, defaults to
+        default_rate_limits. Pass an empty dict to log everything
+        """
+        logging.Handler.__init__(self)
+        self.target_handlers = list(target_handlers)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.rotate_seconds = rotate_seconds
+        self.rate_limits = default_rate_limits if rate_limits is None else rate_limits
+        self.queue = Queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        # (level, file, line): [window start, count, suppressed, last suppressed record]
+        self._rate_windows = {}
+        self._rate_lock = threading.Lock()
+        # handler: time its log file was opened
+        self._opened = dict([(handler, time.time()) for handler in self.target_handlers])
+        # handler: time before which a failed rotation isn't tried again
+        self._rotate_retry_after = {}
+        self._writer = None
+        # set when a warning or error is queued, wakes the writer early
+        self._urgent = threading.Event()
+
+    def start(self):
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._write_records, name="AniAsyncLogWriter")
+            self._writer.daemon = True
+            self._writer.start()
+
+    def stop(self):
+        """
+        Writes every queued record and stops the writer, call before the app exits. install() registers this at exit
+        """
+        if self._writer is not None:
+            with self._rate_lock:
+                windows = self._rate_windows.values()
+                self._rate_windows = {}
+            for window in windows:
+                if window[2]:
+                    self.queue.put(self._make_summary(window[3], window[2]))
+            self.queue.put(None)
+            self._urgent.set()
+            self._writer.join()
+            self._writer = None
+
+    def emit(self, record):
+        try:
+            summary = self._check_rate(record)
+            if summary is False:
+                return
+            if summary is not None:
+                self._enqueue(summary)
+            self._enqueue(self._prepare(record))
+        except Exception:
+            self.handleError(record)
+
+    def _check_rate(self, record):
+        """
+        Applies the rate limit for the record's level and call site
+        :param record: the log record
+        :return: False to drop the record, otherwise None or a summary record of the records dropped in the last window
+        """
+        limit = self.rate_limits.get(record.levelno)
+        if not limit:
+            return None
+        key = (record.levelno, record.pathname, record.lineno)
+        now = time.time()
+        with self._rate_lock:
+            window = self._rate_windows.get(key)
+            if window is None or now - window[0] >= 1.0:
+                self._rate_windows[key] = [now, 1, 0, None]
+                if not window or not window[2]:
+                    return None
+                return self._make_summary(window[3], window[2])
+            if window[1] >= limit:
+                window[2] += 1
+                window[3] = record
+                return False
+            window[1] += 1
+            return None
+
+    @staticmethod
+    def _make_summary(record, suppressed):
+        """
+        :param record: the last record dropped by the rate limit
+        :param suppressed: number of records dropped
+        :return: a record at the same level and call site saying how many records were dropped
+        """
+        summary = logging.makeLogRecord(record.__dict__)
+        summary.msg = "Suppressed {0} similar messages from {1}:{2}".format(
+            suppressed, os.path.basename(record.pathname), record.lineno
+        )
+        summary.args = None
+        summary.exc_info = None
+        summary.exc_text = None
+        return summary
+
+    @staticmethod
+    def _prepare(record):
+        """
+        Keeps the calling thread's work small. The message is only merged now when an argument could change before the
+        writer gets to the record, like a list or an object. The exception is formatted by the writer, the record holds
+        the traceback until then
+        :param record: the log record
+        :return: the record
+        """
+        args = record.args
+        if args and (
+                not isinstance(record.msg, basestring) or not isinstance(args, tuple) or
+                [arg for arg in args if type(arg) not in immutable_types]
+        ):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def _enqueue(self, record):
+        if record.levelno >= logging.WARNING:
+            self.queue.put(record)
+            self._urgent.set()
+            return
+        try:
+            self.queue.put_nowait(record)
+        except Queue.Full:
+            self.dropped += 1
+
+    def _write_records(self):
+        """
+        The writer thread. Waits for a record, takes whatever else is queued up to the batch size, writes and flushes
+        """
+        running = True
+        while running:
+            try:
+                batch = [self.queue.get(timeout=self.flush_interval)]
+            except Queue.Empty:
+                continue
+            # cleared before taking the batch, so a warning queued after this point wakes the wait below
+            self._urgent.clear()
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Queue.Empty:
+                    break
+            if None in batch:
+                running = False
+                batch = [record for record in batch if record is not None]
+            for handler in self.target_handlers:
+                try:
+                    self._write_batch(handler, batch)
+                except Exception:
+                    # same as logging, a failed write never stops the app
+                    pass
+            # let records collect between small batches. Waking for every record competes with the gui and worker
+            # threads for the interpreter lock, which costs them more than the write saves. A queued warning or error
+            # ends the wait early
+            if running and len(batch) < self.batch_size and self.queue.qsize() < self.queue.maxsize / 2:
+                self._urgent.wait(self.flush_interval)
+
+    def _write_batch(self, handler, batch):
+        """
+        Writes a batch of records to a handler. Stream handlers get one flush per batch instead of one per record
+        :param handler: the target handler
+        :param batch: list of log records
+        """
+        records = [record for record in batch if record.levelno >= handler.level and handler.filter(record)]
+        if not records:
+            return
+        if not isinstance(handler, logging.StreamHandler):
+            for record in records:
+                handler.handle(record)
+            return
+
+        handler.acquire()
+        try:
+            for record in records:
+                # checked per record so a large batch can't run the file far past max_bytes
+                if isinstance(handler, logging.FileHandler):
+                    self._rotate_if_needed(handler)
+                msg = handler.format(record)
+                if isinstance(msg, unicode) and not getattr(handler, "encoding", None):
+                    msg = msg.encode("utf-8")
+                handler.stream.write(msg + "\n")
+            handler.stream.flush()
+        finally:
+            handler.release()
+
+    def _rotate_if_needed(self, handler):
+        """
+        Opens a delayed log file and rotates it when it's too large or too old, call with the handler's lock held.
+        Closing the file flushes what was written to it
+        :param handler: a logging.FileHandler
+        """
+        if handler.stream is None:
+            handler.stream = handler._open()
+            self._opened[handler] = time.time()
+        if time.time() < self._rotate_retry_after.get(handler, 0):
+            return
+        # python 2 on windows reports 0 for a file just opened to append until the position is moved, same as
+        # RotatingFileHandler.shouldRollover
+        handler.stream.seek(0, 2)
+        too_large = self.max_bytes and handler.stream.tell() >= self.max_bytes
+        too_old = self.rotate_seconds and time.time() - self._opened.get(handler, time.time()) >= self.rotate_seconds
+        if not (too_large or too_old):
+            return
+
+        handler.stream.close()
+        handler.stream = None
+        file_path = handler.baseFilename
+        try:
+            for index in range(self.backup_count - 1, 0, -1):
+                older_path = "{0}.{1}".format(file_path, index)
+                if os.path.exists(older_path):
+                    newer_path = "{0}.{1}".format(file_path, index + 1)
+                    if os.path.exists(newer_path):
+                        os.remove(newer_path)
+                    os.rename(older_path, newer_path)
+            if self.backup_count:
+                backup_path = file_path + ".1"
+                if os.path.exists(backup_path):
+                    os.remove(backup_path)
+                os.rename(file_path, backup_path)
+            else:
+                os.remove(file_path)
+        except (IOError, OSError):
+            # another process has the log open, keep writing to it and try again later instead of on every record
+            self._rotate_retry_after[handler] = time.time() + self.rotate_retry_seconds
+        handler.stream = handler._open()
+        self._opened[handler] = time.time()
+
+
+def install(logger=None, **kwargs):
+    """
+    Moves a logger's handlers behind an AniAsyncLogHandler. Call after ErrorLogging.setup_logging() so the app's log
+    file and format are kept
+    :param logger: optional logger, defaults to the root logger ErrorLogging sets up
+    :param kwargs: optional AniAsyncLogHandler settings
+    :return: the AniAsyncLogHandler, the existing one if already installed
+    """
+    if logger is None:
+        logger = logging.getLogger()
+    for handler in logger.handlers:
+        if isinstance(handler, AniAsyncLogHandler):
+            return handler
+    async_handler = AniAsyncLogHandler(logger.handlers, **kwargs)
+    logger.handlers = [async_handler]
+    async_handler.start()
+    atexit.register(async_handler.stop)
+    return async_handler
+
+
+class _FsyncFileHandler(logging.FileHandler):
+    """
+    File handler that waits for every flush to reach the disk, stands in for a slow log file like one on a busy
+    network drive
+    """
+
+    def flush(self):
+        logging.FileHandler.flush(self)
+        if self.stream:
+            os.fsync(self.stream.fileno())
+
+
+def benchmark(records=20000, rate_limits=None):
+    """
+    Times each logging call in a sync style loop, a debug message per file, for the synchronous file handler
+    ErrorLogging sets up and for the async handler. Also runs both against a file handler that fsyncs every flush,
+    where the sync handler's calls wait on the disk. Reports the mean, 99th percentile and worst call
+    :param records: number of records to log, the fsync runs log a tenth as many
+    :param rate_limits: optional rate limits for the async handler, see AniAsyncLogHandler
+    :return: the report as a string
+    """
+    log_format = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    log_dir = tempfile.mkdtemp()
+    lines = [
+        "{0:<28} {1:>10} {2:>10} {3:>10} {4:>10}".format("handler", "mean(us)", "p99(us)", "max(us)", "total(s)")
+    ]
+
+    def run(name, make_handler, file_handler_class=logging.FileHandler, count=records):
+        logger = logging.getLogger("async_logging_benchmark.{0}".format(name))
+        logger.propagate = False
+        logger.setLevel(logging.DEBUG)
+        file_handler = file_handler_class(os.path.join(log_dir, "{0}.log".format(name)))
+        file_handler.setFormatter(logging.Formatter(log_format))
+        handler = make_handler(file_handler)
+        logger.handlers = [handler]
+        call_times = []
+        start = timeit.default_timer()
+        for index in range(count):
+            call_start = timeit.default_timer()
+            logger.debug("Downloaded file %s to %s", "/LongGong/sequences/file_{0}.exr".format(index), log_dir)
+            call_times.append(timeit.default_timer() - call_start)
+        seconds = timeit.default_timer() - start
+        if isinstance(handler, AniAsyncLogHandler):
+            handler.stop()
+        file_handler.close()
+        call_times.sort()
+        lines.append(
+            "{0:<28} {1:>10.2f} {2:>10.2f} {3:>10.2f} {4:>10.3f}".format(
+                name, seconds / count * 1e6, call_times[int(count * 0.99)] * 1e6, call_times[-1] * 1e6, seconds
+            )
+        )
+
+    run("sync", lambda file_handler: file_handler)
+    run("async", lambda file_handler: _started(AniAsyncLogHandler([file_handler], rate_limits={})))
+    run(
+        "async_rate_limited",
+        lambda file_handler: _started(AniAsyncLogHandler([file_handler], rate_limits=rate_limits))
+    )
+    slow_records = max(records / 10, 1)
+    run("sync_fsync", lambda file_handler: file_handler, _FsyncFileHandler, slow_records)
+    run(
+        "async_fsync",
+        lambda file_handler: _started(AniAsyncLogHandler([file_handler], rate_limits={})),
+        _FsyncFileHandler,
+        slow_records
+    )
+    return "\n".join(lines)
+
+
+def _started(handler):
+    handler.start()
+    return handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark logging latency per call")
+    parser.add_argument("command", choices=["benchmark"])
+    parser.add_argument("-n", "--records", type=int, default=20000)
+    args = parser.parse_args()
+    print benchmark(records=args.records)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+import os
+import json
+import shutil
+import hashlib
+import subprocess
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+import file_utils
+import package_delta
+
+
+# folders at the top of an app's venv that aren't build inputs, the virtualenv itself and pyinstaller's output
+venv_ignored_dirs = ["build", "dist", "Lib", "Scripts", "Include", "tcl"]
+# folders and files anywhere that aren't build inputs
+ignored_dirs = ["__pycache__"]
+ignored_extensions = [".pyc", ".pyo", ".spec", ".log"]
+
+
+def fingerprint_inputs(input_paths, extra_inputs=None, venv_dir=None):
+    """
+    Makes a fingerprint of everything that goes into an app build. Any change to a source file, image, third party
+    file or extra input, like the pyani lib version, changes the fingerprint
+    :param input_paths: list of files or directories, directories are walked
+    :param extra_inputs: optional dict of other inputs that aren't files, ex: {"pyani": "2.1.0"}
+    :param venv_dir: optional, the app's venv. Its virtualenv and build folders are skipped when walking it, other
+    inputs are walked in full
+    :return: the sha1 hex digest and None, or None and an error if an input doesn't exist
+    """
+    venv_dir = os.path.normcase(os.path.normpath(venv_dir)) if venv_dir else None
+    sha1 = hashlib.sha1()
+    for input_path in sorted(input_paths):
+        if not os.path.exists(input_path):
+            return None, "Build input {0} doesn't exist".format(input_path)
+        if os.path.isfile(input_path):
+            file_paths = [(os.path.basename(input_path), input_path)]
+        else:
+            file_paths = []
+            for dir_path, dir_names, file_names in os.walk(input_path):
+                skipped_dirs = list(ignored_dirs)
+                if venv_dir and os.path.normcase(os.path.normpath(dir_path)) == venv_dir:
+                    skipped_dirs.extend(venv_ignored_dirs)
+                dir_names[:] = sorted([dir_name for dir_name in dir_names if dir_name not in skipped_dirs])
+                for file_name in sorted(file_names):
+                    if os.path.splitext(file_name)[1].lower() in ignored_extensions:
+                        continue
+                    file_path = os.path.join(dir_path, file_name)
+                    file_paths.append((os.path.relpath(file_path, input_path).replace("\\", "/"), file_path))
+        for rel_path, file_path in file_paths:
+            sha1.update(rel_path.encode("utf-8"))
+            sha1.update(file_utils.hash_file(file_path).encode("utf-8"))
+    if extra_inputs:
+        sha1.update(json.dumps(extra_inputs, sort_keys=True).encode("utf-8"))
+    return sha1.hexdigest(), None
+
+
+class AniBuildCache:
+    """
+    Remembers the input fingerprint of every app's last successful build so the packager only rebuilds apps whose
+    inputs changed. The cache json is formatted as:
+        {
+            "pyShoot": "<fingerprint>",
+            ...
+        }
+
+    An app spec is a dict describing how to build an app:
+        {
+            "name": "pyShoot",
+            "venv": "C:\\...\\PyShoot\\venv",
+            "exe_name": "PyShoot",
+            "icon": "images\\pyshoot_icon.ico",
+            "console": True,
+            "pyinstaller_options": [],
+            "inputs": ["C:\\...\\PyShoot\\venv\\main.py", "C:\\...\\PyShoot\\venv\\images", ...],
+            "dist_dir": "C:\\...\\Dist\\source\\PyAniTools\\apps\\pyShoot",
+            "package": "C:\\...\\packages\\pyShoot.zip"
+        }
+    console is optional and defaults to True, gui only apps like PySession set it False to build with --noconsole.
+    pyinstaller_options is an optional list of extra pyinstaller arguments, ex: ["--hidden-import", "scandir"]
+    """
+
+    def __init__(self, cache_path, extra_inputs=None):
+        """
+        :param cache_path: the path including file name for the cache json
+        :param extra_inputs: optional dict of inputs shared by all apps, ex: {"pyani": "2.1.0", "pyinstaller": "3.4"}
+        """
+        self.cache_path = cache_path
+        self.extra_inputs = extra_inputs if extra_inputs else {}
+        self.fingerprints, self.load_error = file_utils.load_json(cache_path, default={})
+        if self.load_error:
+            self.fingerprints = {}
+
+    def fingerprint(self, app_spec):
+        """
+        :param app_spec: the app spec, see class doc
+        :return: the fingerprint of the app's inputs and None, or None and an error
+        """
+        extra_inputs = dict(self.extra_inputs)
+        # the build options change the exe as much as the sources do
+        extra_inputs["console"] = app_spec.get("console", True)
+        extra_inputs["pyinstaller_options"] = app_spec.get("pyinstaller_options", [])
+        return fingerprint_inputs(app_spec["inputs"], extra_inputs=extra_inputs, venv_dir=app_spec["venv"])
+
+    def stale_apps(self, app_specs):
+        """
+        Finds the apps whose inputs changed since their last build, or whose build output is missing
+        :param app_specs: list of app specs, see class doc
+        :return: a list of (app spec, fingerprint) tuples for the apps that need building, and a dict of app name: error
+        for apps whose inputs couldn't be read
+        """
+        stale = []
+        errors = {}
+        for app_spec in app_specs:
+            fingerprint, error = self.fingerprint(app_spec)
+            if error:
+                errors[app_spec["name"]] = error
+                continue
+            exe_path = os.path.join(app_spec["dist_dir"], "{0}.exe".format(app_spec["exe_name"]))
+            if self.fingerprints.get(app_spec["name"]) != fingerprint or not os.path.exists(exe_path):
+                stale.append((app_spec, fingerprint))
+        return stale, errors
+
+    def build(self, app_specs, processes=None):
+        """
+        Builds and packages the stale apps in parallel, skips apps that haven't changed. pyinstaller runs as its own
+        process and zlib releases the GIL while compressing, so a thread per app keeps all cores busy without the
+        windows multiprocessing restrictions.
+        :param app_specs: list of app specs, see class doc
+        :param processes: optional number of apps to build at once, defaults to the number of cores
+        :return: a list of the app names built, a list of the app names skipped, and a dict of app name: error
+        """
+        stale, errors = self.stale_apps(app_specs)
+        stale_names = [app_spec["name"] for app_spec, _ in stale]
+        skipped = [
+            app_spec["name"] for app_spec in app_specs
+            if app_spec["name"] not in stale_names and app_spec["name"] not in errors
+        ]
+        if not stale:
+            return [], skipped, errors
+
+        pool = ThreadPool(processes if processes else multiprocessing.cpu_count())
+        try:
+            results = pool.map(build_app, [app_spec for app_spec, _ in stale])
+        finally:
+            pool.close()
+            pool.join()
+
+        built = []
+        for (app_spec, fingerprint), error in zip(stale, results):
+            if error:
+                errors[app_spec["name"]] = error
+            else:
+                built.append(app_spec["name"])
+                self.fingerprints[app_spec["name"]] = fingerprint
+
+        error = file_utils.write_json(self.cache_path, self.fingerprints)
+        if error:
+            errors[""] = error
+        return built, skipped, errors
+
+
+def build_app(app_spec):
+    """
+    Makes an app's exe with pyinstaller, moves it to the app's dist folder and zips the dist folder into the app's
+    package
+    :param app_spec: the app spec, see AniBuildCache
+    :return: None if built, otherwise error
+    """
+    # each app gets its own work folders so parallel builds don't share pyinstaller's build folder
+    work_dir = os.path.join(app_spec["venv"], "build", "pyani_build")
+    exe_dir = os.path.join(app_spec["venv"], "dist")
+    command = [
+        "pyinstaller", "--onefile", "--console" if app_spec.get("console", True) else "--noconsole", "--noconfirm",
+        "--icon={0}".format(app_spec["icon"]),
+        "--name", app_spec["exe_name"],
+        "--workpath", work_dir,
+        "--distpath", exe_dir
+    ]
+    command.extend(app_spec.get("pyinstaller_options", []))
+    command.append("main.py")
+    try:
+        process = subprocess.Popen(
+            command, cwd=app_spec["venv"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+        )
+        output = process.communicate()[0]
+        if process.returncode != 0:
+            return "Could not build {0}. pyinstaller reported {1}".format(app_spec["name"], output)
+
+        if not os.path.exists(app_spec["dist_dir"]):
+            os.makedirs(app_spec["dist_dir"])
+        exe_name = "{0}.exe".format(app_spec["exe_name"])
+        shutil.copy2(os.path.join(exe_dir, exe_name), os.path.join(app_spec["dist_dir"], exe_name))
+    except (IOError, OSError) as e:
+        return "Could not build {0}. Error reported is {1}".format(app_spec["name"], e)
+
+    if not app_spec.get("package"):
+        return None
+    entries = []
+    for dir_path, dir_names, file_names in os.walk(app_spec["dist_dir"]):
+        for file_name in file_names:
+            file_path = os.path.join(dir_path, file_name)
+            entries.append((os.path.relpath(file_path, app_spec["dist_dir"]).replace("\\", "/"), file_path, None))
+    return package_delta.write_reproducible_zip(app_spec["package"], entries)
@@ -0,0 +1,96 @@
+import os
+import sys
+import json
+import hashlib
+
+
+def hash_file(file_path, block_size=1024 * 1024):
+    """
+    Hashes a file's contents without loading the whole file in memory
+    :param file_path: the file to hash
+    :param block_size: how much to read at a time
+    :return: the sha1 hex digest
+    """
+    sha1 = hashlib.sha1()
+    with open(file_path, "rb") as read_file:
+        while True:
+            data = read_file.read(block_size)
+            if not data:
+                break
+            sha1.update(data)
+    return sha1.hexdigest()
+
+
+def make_hardlink(src_path, dst_path):
+    """
+    Hardlinks a file. Python 2 on windows has no os.link so fall back to the windows api
+    :param src_path: the existing file
+    :param dst_path: the link to make
+    :return: True if linked, False if the file system doesn't allow it, ex: different drives
+    """
+    try:
+        if hasattr(os, "link"):
+            os.link(src_path, dst_path)
+            return True
+        if sys.platform == "win32":
+            import ctypes
+            return bool(ctypes.windll.kernel32.CreateHardLinkW(unicode(dst_path), unicode(src_path), None))
+    except (OSError, AttributeError):
+        pass
+    return False
+
+
+def load_json(json_path, default=None):
+    """
+    Loads a json file
+    :param json_path: the path to the file
+    :param default: optional value returned when the file doesn't exist, if None a missing file is an error
+    :return: the json data and None, or None and an error
+    """
+    if not os.path.exists(json_path) and default is not None:
+        return default, None
+    try:
+        with open(json_path, "r") as read_file:
+            return json.load(read_file), None
+    except (IOError, OSError, EnvironmentError, ValueError) as e:
+        error_msg = "Problem loading {0}. Error reported is {1}".format(json_path, e)
+        return None, error_msg
+
+
+def write_json(json_path, user_data, indent=1):
+    """
+    Write to a json file
+    :param json_path: the path to the file
+    :param user_data: the data to write
+    :param indent: optional indent, defaults to 1 space for each line
+    :return: None if wrote to disk, error if couldn't write
+    """
+    try:
+        with open(json_path, "w") as write_file:
+            json.dump(user_data, write_file, indent=indent, sort_keys=True)
+            return None
+    except (IOError, OSError, EnvironmentError, ValueError) as e:
+        error_msg = "Problem writing {0}. Error reported is {1}".format(json_path, e)
+        return error_msg
+
+
+def replace_file(temp_path, file_path):
+    """
+    Moves a finished temp file over the real file in one step, so readers always find either the old or the new
+    file. Python 2 on windows won't rename over an existing file, so use the windows api there
+    :param temp_path: the finished file
+    :param file_path: the file to replace
+    :return: None if moved, otherwise error
+    """
+    try:
+        if sys.platform == "win32":
+            import ctypes
+            # MOVEFILE_REPLACE_EXISTING | MOVEFILE_WRITE_THROUGH
+            if not ctypes.windll.kernel32.MoveFileExW(unicode(temp_path), unicode(file_path), 0x1 | 0x8):
+                # WindowsError is an OSError
+                raise ctypes.WinError()
+        else:
+            os.rename(temp_path, file_path)
+    except (IOError, OSError) as e:
+        return "Could not write {0}. Error reported is {1}".format(file_path, e)
+    return None
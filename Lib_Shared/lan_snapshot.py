@@ -0,0 +1,382 @@
+'''
+Shared snapshot of the CGT server listings, so the daily update doesn't have every workstation list the server at once
+
+    One machine, the first to get the publish lease or a scheduled service, refreshes the listings from CGT and
+    publishes them to the shared drive:
+        python lan_snapshot.py publish Z:\\LongGong\\tools\\snapshot tools_cache=C:\\...\\cgt_tools_cache.json
+            sequences=C:\\...\\sequences.json
+
+    Workstations copy the listings from the snapshot and only go to CGT for the actual file downloads:
+        python lan_snapshot.py consume Z:\\LongGong\\tools\\snapshot tools_cache=C:\\...\\cgt_tools_cache.json
+            sequences=C:\\...\\sequences.json
+
+    consume exits with 1 when the snapshot is missing or stale, the caller then queries CGT directly.
+    AniLanSnapshot.sync does the whole flow in process, including electing a publisher and the jittered fallback.
+'''
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import zipfile
+import argparse
+import datetime
+
+import file_utils
+import package_delta
+
+
+# points at the current snapshot zip, see AniLanSnapshot
+pointer_name = "snapshot.json"
+# held by the machine publishing a snapshot
+lease_name = "publish.lock"
+
+
+class AniLanSnapshot:
+    """
+    Publishes and consumes a versioned, compressed snapshot of the server listings (tools cache, asset cache,
+    sequences.json, timestamp manifests) on the shared drive.
+
+    Each snapshot is a zip named snapshot_<version>.zip holding the listing files by name. The current one is recorded
+    in snapshot.json, formatted as:
+        {
+            "version": "20200118_020000",
+            "published": 1579305600.0,
+            "host": "ANIM-WS-12",
+            "package": "snapshot_20200118_020000.zip",
+            "files": {
+                "tools_cache": "<sha1 of the file>",
+                ...
+            }
+        }
+
+    Only one machine publishes at a time. It holds a lease file with an expiry, so a publisher that crashes doesn't
+    block everyone until someone deletes the file.
+    """
+
+    def __init__(self, snapshot_dir, max_age_seconds=6 * 3600, lease_seconds=30 * 60, keep_snapshots=3):
+        """
+        :param snapshot_dir: the folder on the shared drive holding the snapshots
+        :param max_age_seconds: a snapshot older than this is stale and workstations fall back to CGT. Defaults to 6
+        hours, long enough to cover a daily update window
+        :param lease_seconds: how long a publisher's lease lasts, should be longer than refreshing the listings takes
+        :param keep_snapshots: number of snapshot zips kept, older ones are removed when a new one is published. A few
+        are kept so a workstation reading the previous snapshot doesn't have it removed mid read
+        """
+        self.snapshot_dir = snapshot_dir
+        self.max_age_seconds = max_age_seconds
+        self.lease_seconds = lease_seconds
+        self.keep_snapshots = keep_snapshots
+        self.pointer_path = os.path.join(snapshot_dir, pointer_name)
+        self.lease_path = os.path.join(snapshot_dir, lease_name)
+        self.host = socket.gethostname()
+        # set while this machine holds the publish lease
+        self.lease_token = None
+
+    def get_current(self):
+        """
+        :return: the snapshot.json data and None, or None and an error. A missing snapshot is an error
+        """
+        return file_utils.load_json(self.pointer_path)
+
+    def is_fresh(self, pointer):
+        """
+        :param pointer: the snapshot.json data
+        :return: True if the snapshot is recent enough to use, False if stale
+        """
+        return time.time() - pointer.get("published", 0) <= self.max_age_seconds
+
+    def publish(self, files):
+        """
+        Publishes the listing files as a new snapshot. If the content matches the current snapshot only the publish
+        time is updated, so workstations don't copy files that didn't change
+        :param files: dict of listing name: local file path
+        :return: None if published, otherwise error
+        """
+        hashes = {}
+        for name, file_path in files.items():
+            if not os.path.exists(file_path):
+                return "Can't publish snapshot, {0} doesn't exist".format(file_path)
+            hashes[name] = file_utils.hash_file(file_path)
+
+        if not os.path.exists(self.snapshot_dir):
+            try:
+                os.makedirs(self.snapshot_dir)
+            except (IOError, OSError) as e:
+                return "Could not create {0}. Error reported is {1}".format(self.snapshot_dir, e)
+
+        pointer, error = self.get_current()
+        if error or pointer.get("files") != hashes or \
+                not os.path.exists(os.path.join(self.snapshot_dir, pointer.get("package", ""))):
+            version = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+            package_name = "snapshot_{0}.zip".format(version)
+            temp_path = os.path.join(self.snapshot_dir, package_name + ".tmp")
+            error = package_delta.write_reproducible_zip(
+                temp_path, [(name, file_path, None) for name, file_path in files.items()]
+            )
+            if error:
+                return error
+            error = file_utils.replace_file(temp_path, os.path.join(self.snapshot_dir, package_name))
+            if error:
+                return error
+            pointer = {"version": version, "package": package_name, "files": hashes}
+
+        pointer["published"] = time.time()
+        pointer["host"] = self.host
+        temp_path = self.pointer_path + ".tmp"
+        error = file_utils.write_json(temp_path, pointer)
+        if error:
+            return error
+        error = file_utils.replace_file(temp_path, self.pointer_path)
+        if error:
+            return error
+        self._remove_old_snapshots(pointer["package"])
+        return None
+
+    def consume(self, files):
+        """
+        Copies the listing files out of the current snapshot. Files that already match the snapshot aren't touched
+        :param files: dict of listing name: local file path
+        :return: True if the local files now match a fresh snapshot, False if the snapshot is missing or stale and
+        the listings should come from CGT. Also returns None or an error
+        """
+        pointer, error = self.get_current()
+        if error or not self.is_fresh(pointer):
+            return False, None
+        missing = [name for name in files if name not in pointer["files"]]
+        if missing:
+            return False, None
+
+        to_copy = [
+            name for name, file_path in files.items()
+            if not os.path.exists(file_path) or file_utils.hash_file(file_path) != pointer["files"][name]
+        ]
+        if not to_copy:
+            return True, None
+
+        package_path = os.path.join(self.snapshot_dir, pointer["package"])
+        try:
+            with zipfile.ZipFile(package_path, "r") as zip_file:
+                for name in to_copy:
+                    file_path = files[name]
+                    file_dir = os.path.dirname(file_path)
+                    if file_dir and not os.path.exists(file_dir):
+                        os.makedirs(file_dir)
+                    temp_path = file_path + ".tmp"
+                    with open(temp_path, "wb") as write_file:
+                        write_file.write(zip_file.read(name))
+                    error = file_utils.replace_file(temp_path, file_path)
+                    if error:
+                        return False, error
+        except (IOError, OSError, KeyError, zipfile.BadZipfile) as e:
+            # the snapshot was replaced while reading or is damaged, the caller falls back to CGT
+            return False, "Could not read snapshot {0}. Error reported is {1}".format(package_path, e)
+        return True, None
+
+    def acquire_lease(self):
+        """
+        Tries to become the publisher. Takes over a lease that has expired by renaming it to a name only this machine
+        uses, a rename only succeeds for one machine, then checks the renamed file is the expired lease it read. So two
+        machines that both see the same expired lease can't both take it, and neither removes the other's new lease
+        :return: True if this machine holds the lease, False if another machine does or the folder can't be made
+        """
+        if not os.path.exists(self.snapshot_dir):
+            try:
+                os.makedirs(self.snapshot_dir)
+            except (IOError, OSError):
+                return False
+        for _ in range(2):
+            try:
+                lease_file = os.open(self.lease_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except OSError:
+                if not self._take_over_expired_lease():
+                    return False
+                continue
+            self.lease_token = "{0}_{1}_{2}".format(self.host, os.getpid(), random.getrandbits(32))
+            with os.fdopen(lease_file, "w") as write_file:
+                write_file.write(
+                    '{{"host": "{0}", "token": "{1}", "expires": {2}}}'.format(
+                        self.host, self.lease_token, time.time() + self.lease_seconds
+                    )
+                )
+            return True
+        return False
+
+    def _take_over_expired_lease(self):
+        """
+        Moves an expired lease out of the way
+        :return: True if the lease was expired and this machine moved it, False if the lease is held or another
+        machine took it over first
+        """
+        try:
+            with open(self.lease_path, "r") as read_file:
+                lease_text = read_file.read()
+            lease_mtime = os.path.getmtime(self.lease_path)
+        except (IOError, OSError):
+            # released since the create failed, try again
+            return True
+        try:
+            expired = time.time() > json.loads(lease_text).get("expires", 0)
+        except ValueError:
+            # being written right now, or damaged. Only take it over once it's old enough to have expired
+            expired = time.time() - lease_mtime > self.lease_seconds
+        if not expired:
+            return False
+
+        taken_path = "{0}.{1}_{2}".format(self.lease_path, self.host, os.getpid())
+        try:
+            os.rename(self.lease_path, taken_path)
+        except OSError:
+            # another machine moved it first
+            return False
+        try:
+            with open(taken_path, "r") as read_file:
+                taken_text = read_file.read()
+        except (IOError, OSError):
+            taken_text = None
+        if taken_text != lease_text:
+            # another machine replaced the expired lease between the read and the rename, give its lease back
+            try:
+                if not os.path.exists(self.lease_path):
+                    os.rename(taken_path, self.lease_path)
+            except OSError:
+                pass
+            return False
+        try:
+            os.remove(taken_path)
+        except OSError:
+            pass
+        return True
+
+    def release_lease(self):
+        """
+        Removes the lease if this machine still holds it
+        """
+        lease, error = file_utils.load_json(self.lease_path)
+        if error or lease.get("token") != self.lease_token:
+            return
+        try:
+            os.remove(self.lease_path)
+        except OSError:
+            pass
+        self.lease_token = None
+
+    def get_lease_expiry(self):
+        """
+        :return: the time the current lease expires, or None if no machine holds the lease
+        """
+        try:
+            lease_mtime = os.path.getmtime(self.lease_path)
+        except OSError:
+            return None
+        lease, error = file_utils.load_json(self.lease_path)
+        if error:
+            # being written right now, or damaged. Treated as expired once it's older than a lease
+            return lease_mtime + self.lease_seconds
+        return lease.get("expires", 0)
+
+    def sync(self, files, refresh_func, jitter_seconds=300, poll_seconds=30):
+        """
+        Gets the listings for a workstation. Uses the snapshot when fresh. When stale the first machine to get the
+        lease refreshes from CGT and publishes. Other machines check for that snapshot while the lease is held. If the
+        lease is released or expires without a fresh snapshot they wait a random time, spreading them out, and query
+        CGT directly
+        :param files: dict of listing name: local file path
+        :param refresh_func: function that refreshes the local listing files from CGT, returns None or an error
+        :param jitter_seconds: the longest a machine waits before querying CGT directly
+        :param poll_seconds: about how often a machine checks for the publisher's snapshot, each wait is randomized so
+        machines don't check together
+        :return: where the listings came from, "snapshot", "published" or "direct", and None or an error
+        """
+        fresh, error = self.consume(files)
+        if fresh:
+            return "snapshot", None
+
+        if self.acquire_lease():
+            try:
+                # another machine may have published and released the lease since the check above
+                fresh, error = self.consume(files)
+                if fresh:
+                    return "snapshot", None
+                error = refresh_func()
+                if error:
+                    return "direct", error
+                return "published", self.publish(files)
+            finally:
+                self.release_lease()
+
+        while True:
+            expires = self.get_lease_expiry()
+            if expires is None or time.time() > expires:
+                break
+            time.sleep(min(random.uniform(poll_seconds / 2.0, poll_seconds * 1.5), expires - time.time() + 1.0))
+            fresh, error = self.consume(files)
+            if fresh:
+                return "snapshot", None
+
+        # the publisher finished without a fresh snapshot or its lease ran out
+        time.sleep(random.uniform(0, jitter_seconds))
+        fresh, error = self.consume(files)
+        if fresh:
+            return "snapshot", None
+        return "direct", refresh_func()
+
+    def _remove_old_snapshots(self, current_package):
+        """
+        Removes snapshot zips past the number kept. A zip another machine is reading can't be removed on windows, it
+        goes on a later publish
+        :param current_package: the current snapshot zip name, never removed
+        """
+        packages = sorted(
+            [
+                file_name for file_name in os.listdir(self.snapshot_dir)
+                if file_name.startswith("snapshot_") and file_name.endswith(".zip") and file_name != current_package
+            ],
+            reverse=True
+        )
+        for file_name in packages[max(self.keep_snapshots - 1, 0):]:
+            try:
+                os.remove(os.path.join(self.snapshot_dir, file_name))
+            except OSError:
+                pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Publish or consume the shared server listing snapshot")
+    parser.add_argument("command", choices=["publish", "consume"])
+    parser.add_argument("snapshot_dir")
+    parser.add_argument("files", nargs="+", help="listing name=local file path")
+    parser.add_argument("-a", "--max_age", type=float, default=6 * 3600, help="seconds before a snapshot is stale")
+    args = parser.parse_args()
+
+    files = dict([file_arg.split("=", 1) for file_arg in args.files])
+    snapshot = AniLanSnapshot(args.snapshot_dir, max_age_seconds=args.max_age)
+
+    if args.command == "publish":
+        if not snapshot.acquire_lease():
+            print "Another machine is publishing the snapshot"
+            sys.exit(1)
+        try:
+            error = snapshot.publish(files)
+        finally:
+            snapshot.release_lease()
+        if error:
+            print error
+            sys.exit(1)
+        print ""
+    else:
+        fresh, error = snapshot.consume(files)
+        if error:
+            print error
+        elif not fresh:
+            print "Snapshot is missing or stale"
+        else:
+            print ""
+        if not fresh:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+import importlib
+import threading
+
+
+class LazyModule(object):
+    """
+    Stands in for a module and imports it the first time an attribute is used. Lets an app's main.py keep its imports
+    at the top of the file while the gui and cgt libraries only load on the code paths that use them, for example:
+
+        qdarkstyle = lazy_import.LazyModule("qdarkstyle")
+        QtWidgets = lazy_import.LazyModule("qtpy.QtWidgets")
+
+        if cli.args.nogui:
+            cli.run()   # qdarkstyle and qtpy never load
+        else:
+            app = QtWidgets.QApplication(sys.argv)
+
+    Set any environment the module reads at import, like QT_API for qtpy, before the first attribute access.
+    """
+
+    def __init__(self, module_name):
+        """
+        :param module_name: the full module name, ex: "pyani.media.movie.create.ui"
+        """
+        # bypass __setattr__ so these live on the proxy, not the module
+        object.__setattr__(self, "_module_name", module_name)
+        object.__setattr__(self, "_module", None)
+        object.__setattr__(self, "_lock", threading.Lock())
+
+    def _load(self):
+        """
+        Imports the module the first time it's needed, thread safe since gui apps touch modules from worker threads
+        :return: the module
+        """
+        module = object.__getattribute__(self, "_module")
+        if module is None:
+            with object.__getattribute__(self, "_lock"):
+                module = object.__getattribute__(self, "_module")
+                if module is None:
+                    module = importlib.import_module(object.__getattribute__(self, "_module_name"))
+                    object.__setattr__(self, "_module", module)
+        return module
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._load(), name, value)
+
+    def __repr__(self):
+        module_name = object.__getattribute__(self, "_module_name")
+        if object.__getattribute__(self, "_module") is None:
+            return "<lazy module '{0}', not loaded>".format(module_name)
+        return repr(object.__getattribute__(self, "_module"))
+
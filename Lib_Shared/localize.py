@@ -0,0 +1,270 @@
+import os
+import time
+import shutil
+import hashlib
+import threading
+from multiprocessing.pool import ThreadPool
+
+import file_utils
+
+
+# read and write in large blocks, the share is much faster with few large requests than many small ones
+copy_buffer_size = 8 * 1024 * 1024
+# the fast hash reads this much from the start and end of a file
+fast_hash_block_size = 1024 * 1024
+
+
+def fast_hash(file_path):
+    """
+    Hashes a file's size and its first and last block. Much cheaper than a full hash on multi GB plates and caches,
+    and catches a file that was re-rendered with the same size
+    :param file_path: the file to hash
+    :return: the sha1 hex digest
+    """
+    sha1 = hashlib.sha1()
+    size = os.path.getsize(file_path)
+    sha1.update(str(size).encode("utf-8"))
+    with open(file_path, "rb") as read_file:
+        sha1.update(read_file.read(fast_hash_block_size))
+        if size > fast_hash_block_size:
+            # files under two blocks are hashed in full, the second read starts where the first ended
+            read_file.seek(max(fast_hash_block_size, size - fast_hash_block_size))
+            sha1.update(read_file.read(fast_hash_block_size))
+    return sha1.hexdigest()
+
+
+def copy_file(src_path, dst_path):
+    """
+    Copies a file with a large buffer. Writes to a temp file first so an interrupted copy never looks up to date
+    :param src_path: the file to copy
+    :param dst_path: where to copy it
+    :return: None if copied, otherwise error
+    """
+    temp_path = dst_path + ".localizing"
+    try:
+        dst_dir = os.path.dirname(dst_path)
+        if not os.path.exists(dst_dir):
+            try:
+                os.makedirs(dst_dir)
+            except OSError:
+                # another copy thread made it
+                if not os.path.isdir(dst_dir):
+                    raise
+        with open(src_path, "rb") as src_file:
+            with open(temp_path, "wb") as dst_file:
+                shutil.copyfileobj(src_file, dst_file, copy_buffer_size)
+        # keep the modified time so the next plan sees the file as up to date
+        shutil.copystat(src_path, temp_path)
+        # windows won't rename over an existing file
+        if os.path.exists(dst_path):
+            os.remove(dst_path)
+        os.rename(temp_path, dst_path)
+    except (IOError, OSError) as e:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return "Could not localize {0}. Error reported is {1}".format(src_path, e)
+    return None
+
+
+class AniLocalizer:
+    """
+    Localizes sequence and shot files, like plates and caches, from the share to the local disk so comps read from
+    local disk. Only files that are new or changed get copied, several files copy at once, and a disk budget evicts the
+    least recently used localized shots to make room.
+
+    Shots are tracked in an index json, formatted as:
+        {
+            "Seq040_Shot020": {
+                "path": "C:\\...\\Seq040\\Shot020",
+                "size": 1234,
+                "last_used": 1579305600.0
+            },
+            ...
+        }
+    """
+
+    index_name = "localized_shots.json"
+
+    def __init__(self, local_root, max_shot_bytes=None, max_total_bytes=None, threads=4, use_fast_hash=False):
+        """
+        :param local_root: the local folder holding localized shots, shots go in <local root>/<seq>/<shot>
+        :param max_shot_bytes: optional largest size a single shot can localize
+        :param max_total_bytes: optional size of all localized shots, older shots get evicted to stay under it
+        :param threads: number of files to copy at once
+        :param use_fast_hash: when a file's size matches but its modified time doesn't, compare a fast hash before
+        copying. Helps when files were touched but not changed
+        """
+        self.local_root = local_root
+        self.max_shot_bytes = max_shot_bytes
+        self.max_total_bytes = max_total_bytes
+        self.threads = threads
+        self.use_fast_hash = use_fast_hash
+        self.index_path = os.path.join(local_root, self.index_name)
+        self._index_lock = threading.Lock()
+        self.index, error = file_utils.load_json(self.index_path, default={})
+        if error:
+            self.index = {}
+        # stats from the last localize
+        self.report = {}
+
+    def shot_dir(self, seq, shot):
+        return os.path.join(self.local_root, seq, shot)
+
+    def plan(self, src_dir, dst_dir):
+        """
+        Works out which files need copying
+        :param src_dir: the folder on the share
+        :param dst_dir: the local folder
+        :return: a list of (source path, destination path, size) to copy, the number of files already up to date, and
+        the total size of all files in the source folder
+        """
+        to_copy = []
+        up_to_date = 0
+        total_size = 0
+        for dir_path, dir_names, file_names in os.walk(src_dir):
+            for file_name in file_names:
+                src_path = os.path.join(dir_path, file_name)
+                dst_path = os.path.join(dst_dir, os.path.relpath(src_path, src_dir))
+                src_stat = os.stat(src_path)
+                total_size += src_stat.st_size
+                if os.path.exists(dst_path):
+                    dst_stat = os.stat(dst_path)
+                    if dst_stat.st_size == src_stat.st_size:
+                        if int(dst_stat.st_mtime) == int(src_stat.st_mtime):
+                            up_to_date += 1
+                            continue
+                        if self.use_fast_hash and fast_hash(src_path) == fast_hash(dst_path):
+                            shutil.copystat(src_path, dst_path)
+                            up_to_date += 1
+                            continue
+                to_copy.append((src_path, dst_path, src_stat.st_size))
+        # copy large files first so a slow large file doesn't end up last with the other threads idle
+        to_copy.sort(key=lambda item: item[2], reverse=True)
+        return to_copy, up_to_date, total_size
+
+    def localize_shot(self, seq, shot, src_dirs):
+        """
+        Localizes a shot's files
+        :param seq: the sequence name, ex: Seq040
+        :param shot: the shot name, ex: Shot020
+        :param src_dirs: dict of folder on the share: folder under the shot's local folder, ex:
+            {"Z:\\LongGong\\sequences\\Seq040\\Shot020\\plates": "plates"}
+        :return: a list of errors, empty if every file localized
+        """
+        start_time = time.time()
+        shot_key = "{0}_{1}".format(seq, shot)
+        shot_dir = self.shot_dir(seq, shot)
+
+        to_copy = []
+        up_to_date = 0
+        shot_size = 0
+        try:
+            for src_dir, rel_dir in src_dirs.items():
+                files, files_up_to_date, size = self.plan(src_dir, os.path.join(shot_dir, rel_dir))
+                to_copy.extend(files)
+                up_to_date += files_up_to_date
+                shot_size += size
+        except (IOError, OSError) as e:
+            return ["Could not read the files for {0}. Error reported is {1}".format(shot_key, e)]
+
+        if self.max_shot_bytes and shot_size > self.max_shot_bytes:
+            return [
+                "{0} needs {1:.1f} GB, more than the {2:.1f} GB allowed for a shot".format(
+                    shot_key, shot_size / 1e9, self.max_shot_bytes / 1e9
+                )
+            ]
+        errors = self.make_room(shot_key, shot_size)
+        if errors:
+            return errors
+
+        pool = ThreadPool(self.threads)
+        try:
+            copy_errors = pool.map(lambda item: copy_file(item[0], item[1]), to_copy)
+        finally:
+            pool.close()
+            pool.join()
+        errors = [error for error in copy_errors if error]
+        copied = [item for item, error in zip(to_copy, copy_errors) if not error]
+
+        with self._index_lock:
+            self.index[shot_key] = {"path": shot_dir, "size": shot_size, "last_used": time.time()}
+            error = self._save_index()
+        if error:
+            errors.append(error)
+
+        seconds = time.time() - start_time
+        bytes_copied = sum([item[2] for item in copied])
+        self.report = {
+            "shot": shot_key,
+            "files_copied": len(copied),
+            "files_up_to_date": up_to_date,
+            "bytes_copied": bytes_copied,
+            "seconds": seconds,
+            "mb_per_second": bytes_copied / 1e6 / seconds if seconds else 0.0
+        }
+        return errors
+
+    def make_room(self, shot_key, shot_size):
+        """
+        Evicts the least recently used localized shots until the shot fits in the disk budget
+        :param shot_key: the shot being localized, never evicted
+        :param shot_size: the size the shot needs
+        :return: a list of errors, empty if there is room
+        """
+        if not self.max_total_bytes:
+            return []
+        errors = []
+        with self._index_lock:
+            used = sum([info["size"] for key, info in self.index.items() if key != shot_key])
+            for key, info in sorted(self.index.items(), key=lambda item: item[1]["last_used"]):
+                if used + shot_size <= self.max_total_bytes:
+                    break
+                if key == shot_key:
+                    continue
+                shutil.rmtree(info["path"], ignore_errors=True)
+                if os.path.exists(info["path"]):
+                    errors.append("Could not remove localized shot {0}, files may be open".format(key))
+                    continue
+                used -= info["size"]
+                del self.index[key]
+            if used + shot_size > self.max_total_bytes:
+                errors.append(
+                    "Not enough room to localize {0}, needs {1:.1f} GB".format(shot_key, shot_size / 1e9)
+                )
+            error = self._save_index()
+            if error:
+                errors.append(error)
+        return errors
+
+    def touch_shot(self, seq, shot):
+        """
+        Marks a localized shot as used so it is evicted last, call when a comp opens the shot
+        :param seq: the sequence name
+        :param shot: the shot name
+        """
+        shot_key = "{0}_{1}".format(seq, shot)
+        with self._index_lock:
+            if shot_key in self.index:
+                self.index[shot_key]["last_used"] = time.time()
+                self._save_index()
+
+    def _save_index(self):
+        """
+        Writes the index, call with the index lock held
+        :return: None if written, otherwise error
+        """
+        if not os.path.exists(self.local_root):
+            try:
+                os.makedirs(self.local_root)
+            except (IOError, OSError) as e:
+                return "Could not create {0}. Error reported is {1}".format(self.local_root, e)
+        return file_utils.write_json(self.index_path, self.index)
+
+    def report_text(self):
+        """
+        :return: the last localize's stats as a string
+        """
+        if not self.report:
+            return ""
+        return "{shot}: copied {files_copied} files ({mb:.1f} MB) in {seconds:.1f}s at {mb_per_second:.1f} MB/s, " \
+               "{files_up_to_date} files already local".format(mb=self.report["bytes_copied"] / 1e6, **self.report)
@@ -0,0 +1,317 @@
+import os
+import json
+import shutil
+import zipfile
+
+import file_utils
+
+
+# name of the manifest stored inside every package, full or delta
+manifest_name = "package_manifest.json"
+# index of releases kept next to the packages on the server, see make_release()
+releases_name = "releases.json"
+# the full package name, the updater falls back to this when it can't apply deltas
+full_package_name = "PyAniToolsPackage.zip"
+# written to the install directory after a package is applied, holds the installed version
+installed_version_name = "package_version.json"
+# every zip entry gets this timestamp so unchanged content makes byte identical zips. Zip can't store dates before 1980
+zip_date_time = (1980, 1, 1, 0, 0, 0)
+
+
+def make_manifest(root_dir, version):
+    """
+    Makes a manifest of every file under a directory. Paths are relative to the directory and use forward slashes so
+    manifests made on different machines compare equal. Format is:
+        {
+            "version": "2.1.0",
+            "files": {
+                "apps/pyShoot/pyShoot.exe": {"sha1": "...", "size": 1234},
+                ...
+            }
+        }
+    :param root_dir: the directory to make the manifest for, ex: Dist/source/PyAniTools
+    :param version: the release version
+    :return: the manifest as a dict
+    """
+    files = {}
+    for dir_path, dir_names, file_names in os.walk(root_dir):
+        dir_names.sort()
+        for file_name in sorted(file_names):
+            file_path = os.path.join(dir_path, file_name)
+            rel_path = os.path.relpath(file_path, root_dir).replace("\\", "/")
+            files[rel_path] = {
+                "sha1": file_utils.hash_file(file_path),
+                "size": os.path.getsize(file_path)
+            }
+    return {"version": version, "files": files}
+
+
+def diff_manifests(old_manifest, new_manifest):
+    """
+    Compares two manifests
+    :param old_manifest: the previous release's manifest, see make_manifest()
+    :param new_manifest: the new release's manifest
+    :return: a sorted list of added or changed file paths, and a sorted list of removed file paths
+    """
+    old_files = old_manifest.get("files", {})
+    new_files = new_manifest.get("files", {})
+    changed = sorted(
+        [
+            rel_path for rel_path, file_info in new_files.items()
+            if rel_path not in old_files or old_files[rel_path]["sha1"] != file_info["sha1"]
+        ]
+    )
+    removed = sorted([rel_path for rel_path in old_files if rel_path not in new_files])
+    return changed, removed
+
+
+def write_reproducible_zip(zip_path, entries):
+    """
+    Writes a zip that is byte identical whenever the content is the same. Entries are written sorted by archive name
+    with a fixed timestamp and permissions, so file system order and modified dates don't change the zip.
+    :param zip_path: the zip file to write
+    :param entries: list of (archive name, file path or None, data or None) tuples. Give either a file path on disk or
+    the data to store as a string
+    :return: None if written, otherwise error
+    """
+    try:
+        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zip_file:
+            for archive_name, file_path, data in sorted(entries, key=lambda entry: entry[0]):
+                zip_info = zipfile.ZipInfo(archive_name, date_time=zip_date_time)
+                zip_info.compress_type = zipfile.ZIP_DEFLATED
+                # regular file, rw-r--r--
+                zip_info.external_attr = 0o100644 << 16
+                if file_path is not None:
+                    with open(file_path, "rb") as read_file:
+                        data = read_file.read()
+                zip_file.writestr(zip_info, data)
+    except (IOError, OSError, zipfile.BadZipfile) as e:
+        return "Could not write zip {0}. Error reported is {1}".format(zip_path, e)
+    return None
+
+
+def write_package(root_dir, rel_paths, zip_path, package_manifest):
+    """
+    Writes a package zip holding the given files and the package manifest. Packages are reproducible, so a release
+    with the same content as the last one makes the same zip
+    :param root_dir: the directory the relative paths are under
+    :param rel_paths: list of forward slash relative paths to add
+    :param zip_path: the zip file to write
+    :param package_manifest: dict written to the zip as manifest_name
+    :return: None if written, otherwise error
+    """
+    entries = [(rel_path, os.path.join(root_dir, *rel_path.split("/")), None) for rel_path in rel_paths]
+    entries.append((manifest_name, None, json.dumps(package_manifest, indent=1, sort_keys=True)))
+    return write_reproducible_zip(zip_path, entries)
+
+
+def make_release(root_dir, release_dir, version):
+    """
+    Makes the packages for a release. Writes to the release directory:
+        manifest_<version>.json - the content hash manifest of every file in the release
+        PyAniToolsPackage.zip - the full package
+        PyAniToolsPackage_<previous version>_to_<version>.zip - only the files that changed since the last release,
+        skipped for the first release
+        releases.json - list of release versions, oldest first
+    Nothing in the release directory changes unless every file is written
+    :param root_dir: the directory to package, ex: Dist/source/PyAniTools
+    :param release_dir: the directory holding the packages and manifests of every release
+    :param version: the release version
+    :return: None if the release was made, otherwise error
+    """
+    if not os.path.exists(release_dir):
+        try:
+            os.makedirs(release_dir)
+        except (IOError, OSError) as e:
+            return "Could not create {0}. Error reported is {1}".format(release_dir, e)
+
+    releases, error = file_utils.load_json(os.path.join(release_dir, releases_name), default=[])
+    if error:
+        return error
+    if version in releases:
+        return "Release {0} already exists in {1}".format(version, release_dir)
+
+    previous_manifest = None
+    if releases:
+        previous_manifest, error = file_utils.load_json(
+            os.path.join(release_dir, "manifest_{0}.json".format(releases[-1]))
+        )
+        if error:
+            return error
+
+    manifest = make_manifest(root_dir, version)
+
+    # everything is written to temp files and only moved into place once every file is written, so a failed release
+    # changes nothing and workstations never download a half written package. releases.json goes last, until it is
+    # replaced workstations see the previous release
+    artifacts = []
+    temp_paths = []
+
+    def add_artifact(file_name, write_func):
+        file_path = os.path.join(release_dir, file_name)
+        temp_path = file_path + ".tmp"
+        temp_paths.append(temp_path)
+        artifacts.append((temp_path, file_path))
+        return write_func(temp_path)
+
+    try:
+        if previous_manifest:
+            previous_version = releases[-1]
+            changed, removed = diff_manifests(previous_manifest, manifest)
+            delta_manifest = {
+                "type": "delta",
+                "from_version": previous_version,
+                "version": version,
+                "files": dict((rel_path, manifest["files"][rel_path]) for rel_path in changed),
+                "removed": removed
+            }
+            error = add_artifact(
+                delta_package_name(previous_version, version),
+                lambda temp_path: write_package(root_dir, changed, temp_path, delta_manifest)
+            )
+            if error:
+                return error
+
+        # the full package always gets made so new installs and out of date machines have something to download
+        full_manifest = {"type": "full", "version": version, "files": manifest["files"]}
+        error = add_artifact(
+            full_package_name,
+            lambda temp_path: write_package(root_dir, sorted(manifest["files"]), temp_path, full_manifest)
+        )
+        if error:
+            return error
+
+        error = add_artifact(
+            "manifest_{0}.json".format(version), lambda temp_path: file_utils.write_json(temp_path, manifest)
+        )
+        if error:
+            return error
+
+        error = add_artifact(
+            releases_name, lambda temp_path: file_utils.write_json(temp_path, releases + [version])
+        )
+        if error:
+            return error
+
+        for temp_path, file_path in artifacts:
+            error = file_utils.replace_file(temp_path, file_path)
+            if error:
+                return error
+        return None
+    finally:
+        for temp_path in temp_paths:
+            if os.path.exists(temp_path):
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+
+def delta_package_name(from_version, to_version):
+    """
+    :return: the file name of the delta package between two releases
+    """
+    return "PyAniToolsPackage_{0}_to_{1}.zip".format(from_version, to_version)
+
+
+def plan_update(releases, installed_version):
+    """
+    Works out which packages the updater needs to download
+    :param releases: the list of releases from releases.json, oldest first
+    :param installed_version: the version installed on the machine, empty if nothing is installed
+    :return: a list of package file names to download and apply in order. A list with only the full package name means
+    deltas can't be used, an empty list means the install is up to date
+    """
+    if not releases:
+        return []
+    if installed_version == releases[-1]:
+        return []
+    if installed_version not in releases:
+        return [full_package_name]
+    index = releases.index(installed_version)
+    return [
+        delta_package_name(releases[i], releases[i + 1]) for i in range(index, len(releases) - 1)
+    ]
+
+
+def verify_install(install_dir, manifest):
+    """
+    Checks the installed files match a manifest
+    :param install_dir: the directory the package was extracted to
+    :param manifest: the manifest to check against, see make_manifest()
+    :return: a sorted list of relative paths that are missing or whose contents don't match
+    """
+    mismatched = []
+    for rel_path, file_info in manifest.get("files", {}).items():
+        file_path = os.path.join(install_dir, *rel_path.split("/"))
+        if (
+            not os.path.exists(file_path) or
+            os.path.getsize(file_path) != file_info["size"] or
+            file_utils.hash_file(file_path) != file_info["sha1"]
+        ):
+            mismatched.append(rel_path)
+    return sorted(mismatched)
+
+
+def apply_package(zip_path, install_dir, installed_version=""):
+    """
+    Extracts a full or delta package over an install. Files are extracted to a staging folder and hash checked first,
+    so a bad download leaves the install untouched. A delta is only applied over the version it was made from.
+    :param zip_path: the downloaded package
+    :param install_dir: the install directory, ex: C:\\PyAniTools
+    :param installed_version: the version currently installed, needed for delta packages, see get_installed_version()
+    :return: None if applied, otherwise error
+    """
+    staging_dir = os.path.join(install_dir, ".package_staging")
+    try:
+        with zipfile.ZipFile(zip_path, "r") as package:
+            package_manifest = json.loads(package.read(manifest_name))
+            if package_manifest["type"] == "delta" and package_manifest["from_version"] != installed_version:
+                return "Package {0} updates version {1}, but version {2} is installed".format(
+                    zip_path, package_manifest["from_version"], installed_version
+                )
+            if os.path.exists(staging_dir):
+                shutil.rmtree(staging_dir)
+            for rel_path in package_manifest["files"]:
+                package.extract(rel_path, staging_dir)
+    except (IOError, OSError, KeyError, ValueError, zipfile.BadZipfile) as e:
+        return "Could not extract package {0}. Error reported is {1}".format(zip_path, e)
+
+    bad_files = verify_install(staging_dir, package_manifest)
+    if bad_files:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        return "Package {0} is corrupt, these files failed verification: {1}".format(zip_path, ", ".join(bad_files))
+
+    try:
+        for rel_path in package_manifest["files"]:
+            src_path = os.path.join(staging_dir, *rel_path.split("/"))
+            dst_path = os.path.join(install_dir, *rel_path.split("/"))
+            dst_dir = os.path.dirname(dst_path)
+            if not os.path.exists(dst_dir):
+                os.makedirs(dst_dir)
+            # windows won't rename over an existing file
+            if os.path.exists(dst_path):
+                os.remove(dst_path)
+            os.rename(src_path, dst_path)
+        for rel_path in package_manifest.get("removed", []):
+            file_path = os.path.join(install_dir, *rel_path.split("/"))
+            if os.path.exists(file_path):
+                os.remove(file_path)
+    except (IOError, OSError) as e:
+        return "Could not install package {0}. Error reported is {1}".format(zip_path, e)
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+    return file_utils.write_json(
+        os.path.join(install_dir, installed_version_name), {"version": package_manifest["version"]}
+    )
+
+
+def get_installed_version(install_dir):
+    """
+    :param install_dir: the install directory, ex: C:\\PyAniTools
+    :return: the version of the last package applied, or an empty string if no package was applied
+    """
+    version_info, error = file_utils.load_json(os.path.join(install_dir, installed_version_name), default={})
+    if error:
+        return ""
+    return version_info.get("version", "")
@@ -0,0 +1,232 @@
+'''
+Startup profiling for the app entry points
+
+    Per module import cost of one entry point, slowest first:
+        python startup_profile.py profile ..\PyShoot\venv\main.py --nogui
+
+    Cold start benchmark of every entry point in headless mode, compared against a saved baseline:
+        python startup_profile.py benchmark startup_baseline.json
+        python startup_profile.py benchmark startup_baseline.json --update
+
+    Headless means the gui apps' main.py files are loaded without calling main(), which measures the import cost paid
+    before any window opens, and the bridge scripts are run with --help.
+'''
+
+import os
+import sys
+import time
+import json
+import runpy
+import argparse
+import subprocess
+
+try:
+    import __builtin__ as builtins
+except ImportError:
+    import builtins
+
+
+# the repo root, entry points are relative to it
+repo_root = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+bridge_dir = os.path.join("Dist", "source", "PyAniTools_install_2.0.0", "app_bridge")
+
+# name: (path relative to the repo root, arguments or None to load the file without running it as __main__)
+entry_points = {
+    "PyShoot": (os.path.join("PyShoot", "venv", "main.py"), None),
+    "PyExrViewer": (os.path.join("PyExrViewer", "venv", "main.py"), None),
+    "PyRenderDataViewer": (os.path.join("PyRenderDataViewer", "venv", "main.py"), None),
+    "PyNukeMngr": (os.path.join("PyNukeMngr", "venv", "main.py"), None),
+    "PyAssetManager": (os.path.join("PyAssetManager", "venv", "main.py"), None),
+    "PySession": (os.path.join("PySession", "venv", "main.py"), None),
+    "PyReviewDownload": (os.path.join("PyReviewDownload", "venv", "main.py"), None),
+    "PyAniToolsUpdate": (os.path.join("PyAniToolsUpdate", "venv", "main.py"), None),
+    "PyAniToolsSetup": (os.path.join("PyAniToolsSetup", "venv", "main.py"), None),
+    "PyAniToolsAppLauncher": (os.path.join("PyAniToolsAppLauncher", "venv", "main.py"), None),
+    "cgt_file_info": (os.path.join(bridge_dir, "cgt_file_info.py"), ["--help"]),
+    "cgt_download": (os.path.join(bridge_dir, "cgt_download.py"), None),
+    "cgt_show_info": (os.path.join(bridge_dir, "cgt_show_info.py"), None),
+    "cgt_get_notes": (os.path.join(bridge_dir, "cgt_get_notes.py"), None),
+    "cgt_review_catalog": (os.path.join(bridge_dir, "cgt_review_catalog.py"), None)
+}
+
+# a start is a regression when it is this much slower than the baseline, both relative and in seconds so noise on fast
+# entry points doesn't get flagged
+regression_ratio = 1.2
+regression_seconds = 0.05
+
+
+class AniImportProfiler:
+    """
+    Times every module imported while it is installed. Cumulative time includes the modules a module imports, self
+    time doesn't. Only first imports are timed, a module already in sys.modules costs nothing
+    """
+
+    def __init__(self):
+        # module name: [cumulative seconds, self seconds, import depth]
+        self.timings = {}
+        self._original_import = None
+        self._child_time = [0.0]
+
+    def install(self):
+        self._original_import = builtins.__import__
+        builtins.__import__ = self._timed_import
+
+    def uninstall(self):
+        if self._original_import:
+            builtins.__import__ = self._original_import
+            self._original_import = None
+
+    def _timed_import(self, name, *args, **kwargs):
+        if name in sys.modules:
+            return self._original_import(name, *args, **kwargs)
+
+        self._child_time.append(0.0)
+        start = time.time()
+        try:
+            return self._original_import(name, *args, **kwargs)
+        finally:
+            cumulative = time.time() - start
+            child_time = self._child_time.pop()
+            self._child_time[-1] += cumulative
+            if name in sys.modules and name not in self.timings:
+                self.timings[name] = [cumulative, cumulative - child_time, len(self._child_time) - 1]
+
+    def report(self, limit=40):
+        """
+        :param limit: number of modules to show
+        :return: the slowest modules by cumulative time as a string
+        """
+        lines = ["{0:>10} {1:>10}  {2}".format("cumul(ms)", "self(ms)", "module")]
+        for name, timing in sorted(self.timings.items(), key=lambda item: item[1][0], reverse=True)[:limit]:
+            lines.append(
+                "{0:>10.1f} {1:>10.1f}  {2}{3}".format(timing[0] * 1000, timing[1] * 1000, "  " * timing[2], name)
+            )
+        return "\n".join(lines)
+
+
+def profile_script(script_path, args=None):
+    """
+    Runs a script with the import profiler installed
+    :param script_path: the script to run
+    :param args: optional arguments, when None the script is loaded without running as __main__
+    :return: the AniImportProfiler with the timings
+    """
+    profiler = AniImportProfiler()
+    sys.argv = [script_path] + (args if args else [])
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script_path)))
+    profiler.install()
+    try:
+        runpy.run_path(script_path, run_name="__main__" if args is not None else "startup_profile")
+    except SystemExit:
+        # argparse exits after --help
+        pass
+    finally:
+        profiler.uninstall()
+    return profiler
+
+
+def time_cold_start(script_path, args=None, runs=5):
+    """
+    Times starting a fresh python process for an entry point
+    :param script_path: the entry point
+    :param args: optional arguments, when None the script is loaded without running as __main__
+    :param runs: number of times to start it, the median is used
+    :return: the median seconds and None, or None and the error output
+    """
+    if args is None:
+        command = [
+            sys.executable, "-c",
+            "import runpy, sys; sys.path.insert(0, {0!r}); runpy.run_path({1!r}, run_name='startup_profile')".format(
+                os.path.dirname(script_path), script_path
+            )
+        ]
+    else:
+        command = [sys.executable, script_path] + args
+
+    timings = []
+    for _ in range(runs):
+        start = time.time()
+        process = subprocess.Popen(
+            command, cwd=os.path.dirname(script_path), stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        output, error_output = process.communicate()
+        if process.returncode != 0:
+            return None, error_output
+        timings.append(time.time() - start)
+    timings.sort()
+    return timings[len(timings) // 2], None
+
+
+def benchmark(baseline_path, update=False, runs=5):
+    """
+    Times the cold start of every entry point and compares against the baseline
+    :param baseline_path: json file of entry point name: seconds
+    :param update: write the new timings as the baseline
+    :param runs: number of starts per entry point
+    :return: the report as a string and a list of the entry points that regressed
+    """
+    baseline = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path, "r") as read_file:
+            baseline = json.load(read_file)
+
+    results = {}
+    regressions = []
+    lines = ["{0:<24} {1:>10} {2:>10}  {3}".format("entry point", "start(s)", "baseline", "status")]
+    for name in sorted(entry_points):
+        rel_path, args = entry_points[name]
+        script_path = os.path.join(repo_root, rel_path)
+        if not os.path.exists(script_path):
+            lines.append("{0:<24} {1:>10} {2:>10}  missing".format(name, "-", "-"))
+            continue
+        seconds, error = time_cold_start(script_path, args=args, runs=runs)
+        if error:
+            lines.append("{0:<24} {1:>10} {2:>10}  error: {3}".format(name, "-", "-", error.strip().splitlines()[-1]))
+            continue
+        results[name] = seconds
+        status = "ok"
+        if name in baseline:
+            previous = baseline[name]
+            if seconds > previous * regression_ratio and seconds - previous > regression_seconds:
+                status = "REGRESSION"
+                regressions.append(name)
+            lines.append("{0:<24} {1:>10.3f} {2:>10.3f}  {3}".format(name, seconds, previous, status))
+        else:
+            lines.append("{0:<24} {1:>10.3f} {2:>10}  new".format(name, seconds, "-"))
+
+    if update:
+        baseline.update(results)
+        with open(baseline_path, "w") as write_file:
+            json.dump(baseline, write_file, indent=4, sort_keys=True)
+
+    return "\n".join(lines), regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile and benchmark entry point startup")
+    subparsers = parser.add_subparsers(dest="command")
+
+    profile_parser = subparsers.add_parser("profile", help="per module import cost of an entry point")
+    profile_parser.add_argument("script")
+    profile_parser.add_argument("script_args", nargs=argparse.REMAINDER)
+    profile_parser.add_argument("-l", "--limit", type=int, default=40)
+
+    benchmark_parser = subparsers.add_parser("benchmark", help="cold start of every entry point")
+    benchmark_parser.add_argument("baseline")
+    benchmark_parser.add_argument("-u", "--update", action="store_true")
+    benchmark_parser.add_argument("-r", "--runs", type=int, default=5)
+
+    args = parser.parse_args()
+
+    if args.command == "profile":
+        profiler = profile_script(args.script, args.script_args if args.script_args else None)
+        print(profiler.report(limit=args.limit))
+    else:
+        report, regressions = benchmark(args.baseline, update=args.update, runs=args.runs)
+        print(report)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
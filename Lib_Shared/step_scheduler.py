@@ -0,0 +1,327 @@
+import time
+import threading
+import multiprocessing
+
+
+# step name: (steps that must finish first, resource the step mostly uses) for the step lists in
+# PyAniToolsUpdate/venv/main.py and PyAniToolsSetup/venv/main.py. Steps not listed have no dependencies and use the
+# network, so the server fetches run at the same time
+UPDATE_STEP_DEPENDENCIES = {
+    "Checking updates for desktop shortcut for pyAniTools": (["Updating local cgt tool cache"], "disk"),
+    "Checking updates for Nuke customization": (["Updating local cgt tool cache"], "disk")
+}
+
+SETUP_STEP_DEPENDENCIES = {
+    "Installing dependencies": ([], "disk"),
+    "Downloading and setting up tools": (["Installing dependencies", "Creating local cgt tools cache"], "network"),
+    "Initializing update configuration": (["Creating local cgt asset cache", "Creating local cgt tools cache"], "disk"),
+    "Creating application support launcher": (["Installing dependencies"], "disk"),
+    "Creating desktop shortcut for pyAniTools": (["Downloading and setting up tools"], "disk"),
+    "Setting up Nuke plugin paths": (["Downloading and setting up tools"], "disk"),
+    "Setting up daily updates": (["Installing dependencies"], "cpu")
+}
+
+
+class AniStep:
+    """
+    A single unit of work run by AniStepScheduler. The step's function follows the pyani convention of returning
+    None when successful or an error message
+    """
+
+    def __init__(self, name, fn, depends_on=None, resource="network"):
+        """
+        :param name: the step name, this is the text shown in the gui progress, ex: "Updating local cgt tool cache"
+        :param fn: the function to call, takes no arguments and returns None or an error
+        :param depends_on: optional list of step names that must finish before this step starts
+        :param resource: the resource class the step mostly uses, one of AniStepScheduler.resource_limits keys
+        """
+        self.name = name
+        self.fn = fn
+        self.depends_on = depends_on if depends_on else []
+        self.resource = resource
+        # filled in when the step runs
+        self.queued_time = None
+        self.start_time = None
+        self.end_time = None
+        self.error = None
+        self.skipped = False
+
+    def duration(self):
+        """
+        :return: how long the step ran in seconds, 0 if it didn't run
+        """
+        if self.start_time is None or self.end_time is None:
+            return 0.0
+        return self.end_time - self.start_time
+
+    def wait_time(self):
+        """
+        :return: how long the step waited for a free resource slot in seconds, 0 if it didn't run
+        """
+        if self.queued_time is None or self.start_time is None:
+            return 0.0
+        return self.start_time - self.queued_time
+
+
+class AniStepScheduler:
+    """
+    Runs a list of steps where each step declares the steps it depends on and the resource it uses. Steps whose
+    dependencies are done run concurrently, limited by how many steps of a resource class can run at once. A step
+    that errors causes the steps depending on it to be skipped, independent steps still run.
+
+    Usage:
+        scheduler = AniStepScheduler(step_finished_callback=progress_callback)
+        scheduler.add_step("Updating local cgt tool cache", update_tools_cache)
+        scheduler.add_step("Checking updates for Nuke customization", update_nuke,
+                           depends_on=["Updating local cgt tool cache"], resource="disk")
+        errors = scheduler.run()
+        print scheduler.timing_report()
+
+    The callbacks are called from the worker threads, so gui code should emit a signal from them rather than touch
+    widgets directly.
+    """
+
+    # how many steps of each resource class can run at the same time
+    resource_limits = {
+        "network": 4,
+        "disk": 2,
+        "cpu": multiprocessing.cpu_count()
+    }
+
+    def __init__(self, step_started_callback=None, step_finished_callback=None, resource_limits=None):
+        """
+        :param step_started_callback: optional function called with the step name when a step starts
+        :param step_finished_callback: optional function called with the step name and error (None if no error) when
+        a step finishes or is skipped
+        :param resource_limits: optional dict of resource class: max concurrent steps, overrides the class defaults
+        """
+        self.step_started_callback = step_started_callback
+        self.step_finished_callback = step_finished_callback
+        self.resource_limits = dict(AniStepScheduler.resource_limits)
+        if resource_limits:
+            self.resource_limits.update(resource_limits)
+        # steps in the order they were added, the gui shows steps in this order
+        self.steps = []
+        self._steps_by_name = {}
+        self._lock = threading.Condition()
+        self._start_time = None
+        self._end_time = None
+
+    def add_step(self, name, fn, depends_on=None, resource="network"):
+        """
+        Adds a step, see AniStep for parameters
+        :return: the AniStep object
+        """
+        step = AniStep(name, fn, depends_on=depends_on, resource=resource)
+        self.steps.append(step)
+        self._steps_by_name[name] = step
+        return step
+
+    def step_names(self):
+        """
+        :return: the step names in the order added, this is the list the pyani gui classes take for progress
+        """
+        return [step.name for step in self.steps]
+
+    def validate(self):
+        """
+        Checks every dependency and resource is known and that the dependencies don't form a cycle
+        :return: None if valid, otherwise error
+        """
+        for step in self.steps:
+            if step.resource not in self.resource_limits:
+                return "Step {0} uses unknown resource {1}".format(step.name, step.resource)
+            for dependency in step.depends_on:
+                if dependency not in self._steps_by_name:
+                    return "Step {0} depends on unknown step {1}".format(step.name, dependency)
+
+        # depth first search for cycles, 1 = visiting, 2 = done
+        state = {}
+
+        def visit(step_name):
+            state[step_name] = 1
+            for dependency in self._steps_by_name[step_name].depends_on:
+                if state.get(dependency) == 1:
+                    return "Steps {0} and {1} depend on each other".format(step_name, dependency)
+                if not state.get(dependency):
+                    error = visit(dependency)
+                    if error:
+                        return error
+            state[step_name] = 2
+            return None
+
+        for step in self.steps:
+            if not state.get(step.name):
+                error = visit(step.name)
+                if error:
+                    return error
+        return None
+
+    def run(self):
+        """
+        Runs all steps and blocks until they are done
+        :return: a dict of step name: error for every step that errored or was skipped, empty if all steps succeeded
+        """
+        error = self.validate()
+        if error:
+            return {"": error}
+
+        running = dict((resource, 0) for resource in self.resource_limits)
+        pending = list(self.steps)
+        finished = set()
+        threads = []
+        self._start_time = time.time()
+
+        for step in self.steps:
+            step.queued_time = None
+            step.start_time = None
+            step.end_time = None
+            step.error = None
+            step.skipped = False
+
+        with self._lock:
+            while pending:
+                started_any = False
+                for step in list(pending):
+                    # skip steps whose dependencies failed, they can never run
+                    failed = [
+                        dependency for dependency in step.depends_on
+                        if self._steps_by_name[dependency].error or self._steps_by_name[dependency].skipped
+                    ]
+                    if failed:
+                        pending.remove(step)
+                        step.skipped = True
+                        step.error = "Skipped because {0} did not complete".format(", ".join(failed))
+                        finished.add(step.name)
+                        self._notify_finished(step)
+                        started_any = True
+                        continue
+                    if not all(dependency in finished for dependency in step.depends_on):
+                        continue
+                    if step.queued_time is None:
+                        step.queued_time = time.time()
+                    if running[step.resource] >= self.resource_limits[step.resource]:
+                        continue
+                    pending.remove(step)
+                    running[step.resource] += 1
+                    thread = threading.Thread(target=self._run_step, args=(step, running, finished))
+                    thread.daemon = True
+                    threads.append(thread)
+                    thread.start()
+                    started_any = True
+                # nothing could start, wait for a running step to finish
+                if pending and not started_any:
+                    self._lock.wait()
+
+        for thread in threads:
+            thread.join()
+        self._end_time = time.time()
+
+        return dict((step.name, step.error) for step in self.steps if step.error)
+
+    def _run_step(self, step, running, finished):
+        """
+        Runs a step in a worker thread and wakes the scheduler when done
+        :param step: the AniStep to run
+        :param running: dict of resource class: number of running steps, shared with the scheduler
+        :param finished: set of finished step names, shared with the scheduler
+        """
+        step.start_time = time.time()
+        if self.step_started_callback:
+            self.step_started_callback(step.name)
+        try:
+            step.error = step.fn()
+        except Exception as e:
+            step.error = "Step {0} failed. Error reported is {1}".format(step.name, e)
+        step.end_time = time.time()
+        self._notify_finished(step)
+
+        with self._lock:
+            running[step.resource] -= 1
+            finished.add(step.name)
+            self._lock.notify_all()
+
+    def _notify_finished(self, step):
+        """
+        Calls the step finished callback
+        :param step: the AniStep that finished or was skipped
+        """
+        if self.step_finished_callback:
+            self.step_finished_callback(step.name, step.error)
+
+    def critical_path(self):
+        """
+        Finds the slowest chain of dependent steps from the last run, this is the lower bound for the total time
+        :return: the list of step names in the chain and the chain's total duration in seconds
+        """
+        longest = {}
+
+        def chain(step_name):
+            if step_name not in longest:
+                step = self._steps_by_name[step_name]
+                best_names, best_time = [], 0.0
+                for dependency in step.depends_on:
+                    names, total = chain(dependency)
+                    if total > best_time:
+                        best_names, best_time = names, total
+                longest[step_name] = (best_names + [step_name], best_time + step.duration())
+            return longest[step_name]
+
+        slowest_names, slowest_time = [], 0.0
+        for step in self.steps:
+            names, total = chain(step.name)
+            if total > slowest_time:
+                slowest_names, slowest_time = names, total
+        return slowest_names, slowest_time
+
+    def timing_report(self):
+        """
+        Makes a per step timing report of the last run
+        :return: the report as a string
+        """
+        lines = ["{0:<60} {1:<8} {2:>9} {3:>9}  {4}".format("Step", "Resource", "Wait(s)", "Run(s)", "Status")]
+        for step in self.steps:
+            if step.skipped:
+                status = "skipped"
+            elif step.error:
+                status = "error"
+            else:
+                status = "ok"
+            lines.append(
+                "{0:<60} {1:<8} {2:>9.2f} {3:>9.2f}  {4}".format(
+                    step.name, step.resource, step.wait_time(), step.duration(), status
+                )
+            )
+
+        total_time = 0.0
+        if self._start_time is not None and self._end_time is not None:
+            total_time = self._end_time - self._start_time
+        chain_names, chain_time = self.critical_path()
+        lines.append("")
+        lines.append("Total time: {0:.2f}s, sum of all steps: {1:.2f}s".format(
+            total_time, sum([step.duration() for step in self.steps])
+        ))
+        lines.append("Slowest chain: {0:.2f}s ({1})".format(chain_time, " -> ".join(chain_names)))
+        return "\n".join(lines)
+
+
+def build_scheduler(steps, step_dependencies, step_functions, step_started_callback=None, step_finished_callback=None):
+    """
+    Makes a scheduler from the step list the app main.py files pass to the pyani gui classes
+    :param steps: list of step names in the order shown in the gui
+    :param step_dependencies: dict of step name: (list of step names it depends on, resource class), for example
+    UPDATE_STEP_DEPENDENCIES. Steps not in the dict have no dependencies and use the network
+    :param step_functions: dict of step name: function that runs the step
+    :param step_started_callback: optional, see AniStepScheduler
+    :param step_finished_callback: optional, see AniStepScheduler
+    :return: the AniStepScheduler object and None, or None and an error if a step has no function
+    """
+    scheduler = AniStepScheduler(
+        step_started_callback=step_started_callback, step_finished_callback=step_finished_callback
+    )
+    for step_name in steps:
+        if step_name not in step_functions:
+            return None, "No function provided for step {0}".format(step_name)
+        depends_on, resource = step_dependencies.get(step_name, ([], "network"))
+        scheduler.add_step(step_name, step_functions[step_name], depends_on=depends_on, resource=resource)
+    return scheduler, None